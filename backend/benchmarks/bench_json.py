@@ -0,0 +1,125 @@
+import json
+import random
+import string
+import timeit
+from src.json_output import dumps, orjson
+
+# Microbenchmark of the API's JSON encoding on Spotify-sized payloads.
+# Run from backend/: python -m benchmarks.bench_json
+#
+# Compares json.dumps (flask_restx's default representation) with src.json_output.dumps (orjson) and checks that
+# both decode to the same value.
+
+MARKETS = [a + b for a in string.ascii_uppercase[:15] for b in string.ascii_uppercase[:13]][:185]
+
+
+def random_id(rng):
+    return ''.join(rng.choice(string.ascii_letters + string.digits) for _ in range(22))
+
+
+def image(rng, size):
+    return {'url': f'https://i.scdn.co/image/{random_id(rng)}', 'height': size, 'width': size}
+
+
+def artist(rng, full=False):
+    artist_id = random_id(rng)
+    simple = {
+        'external_urls': {'spotify': f'https://open.spotify.com/artist/{artist_id}'},
+        'href': f'https://api.spotify.com/v1/artists/{artist_id}',
+        'id': artist_id,
+        'name': f'Artist {artist_id[:6]}',
+        'type': 'artist',
+        'uri': f'spotify:artist:{artist_id}'
+    }
+    if full:
+        simple.update({
+            'followers': {'href': None, 'total': rng.randint(100, 10_000_000)},
+            'genres': rng.sample(['indie pop', 'bedroom pop', 'dream pop', 'shoegaze', 'lo-fi', 'alt z', 'r&b'], 3),
+            'images': [image(rng, 640), image(rng, 320), image(rng, 160)],
+            'popularity': rng.randint(0, 100)
+        })
+    return simple
+
+
+def track(rng):
+    track_id = random_id(rng)
+    album_id = random_id(rng)
+    return {
+        'album': {
+            'album_type': 'album',
+            'artists': [artist(rng)],
+            'available_markets': MARKETS,
+            'external_urls': {'spotify': f'https://open.spotify.com/album/{album_id}'},
+            'href': f'https://api.spotify.com/v1/albums/{album_id}',
+            'id': album_id,
+            'images': [image(rng, 640), image(rng, 300), image(rng, 64)],
+            'name': f'Album {album_id[:6]}',
+            'release_date': '2019-06-28',
+            'release_date_precision': 'day',
+            'total_tracks': 12,
+            'type': 'album',
+            'uri': f'spotify:album:{album_id}'
+        },
+        'artists': [artist(rng) for _ in range(rng.randint(1, 3))],
+        'available_markets': MARKETS,
+        'disc_number': 1,
+        'duration_ms': rng.randint(120_000, 300_000),
+        'explicit': rng.random() < 0.2,
+        'external_ids': {'isrc': 'USUM71900000'},
+        'external_urls': {'spotify': f'https://open.spotify.com/track/{track_id}'},
+        'href': f'https://api.spotify.com/v1/tracks/{track_id}',
+        'id': track_id,
+        'is_local': False,
+        'name': f'Track {track_id[:6]} (feat. Someone) – Remastered',
+        'popularity': rng.randint(0, 100),
+        'preview_url': None,
+        'track_number': rng.randint(1, 12),
+        'type': 'track',
+        'uri': f'spotify:track:{track_id}'
+    }
+
+
+def payloads():
+    rng = random.Random(0)
+    return {
+        # /api/spotify/top: 50 top tracks + 50 top artists
+        'top data': {
+            'top_tracks': {'items': [track(rng) for _ in range(50)], 'total': 50, 'limit': 50, 'offset': 0},
+            'top_artists': {'items': [artist(rng, full=True) for _ in range(50)], 'total': 50, 'limit': 50, 'offset': 0}
+        },
+        # /api/spotify/saved_tracks: one page of 50
+        'saved tracks page': {
+            'items': [{'added_at': '2024-05-01T12:00:00Z', 'track': track(rng)} for _ in range(50)],
+            'total': 2000, 'limit': 50, 'offset': 0
+        },
+        # /get_playlist: a 100 track playlist
+        'playlist tracks': {
+            'id': 'b6d7cbd4-1b1c-4b8e-9d6c-0a1f0d0a0f0f',
+            'playlist_name': 'Rainy day',
+            'tracks': [{
+                'spotify_track_id': random_id(rng),
+                'track_name': f'Track {i}',
+                'artist_name': f'Artist {i}'
+            } for i in range(100)]
+        }
+    }
+
+
+def main(number=200):
+    print(f"fast backend: {'orjson' if orjson else 'json (orjson not installed)'}")
+    print(f"{'payload':<20}{'size':>10}{'json.dumps':>14}{'fast':>12}{'speedup':>10}")
+    for name, payload in payloads().items():
+        baseline = json.dumps(payload)
+        fast = dumps(payload)
+        assert json.loads(baseline) == json.loads(fast), f'{name}: outputs differ'
+
+        baseline_time = timeit.timeit(lambda: json.dumps(payload), number=number) / number
+        fast_time = timeit.timeit(lambda: dumps(payload), number=number) / number
+        print(
+            f"{name:<20}{len(fast) / 1024:>8.0f}KB{baseline_time * 1000:>12.3f}ms{fast_time * 1000:>10.3f}ms"
+            f"{baseline_time / fast_time:>9.1f}x"
+        )
+
+
+if __name__ == '__main__':
+    main()
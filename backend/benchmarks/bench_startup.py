@@ -0,0 +1,92 @@
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+# Cold start benchmark: time to import src.app and to run create_app() in a fresh interpreter, the work every
+# gunicorn worker (or autoscaled container) does before serving its first request.
+# Run from backend/: python -m benchmarks.bench_startup [--runs 5] [--max-seconds 1.5]
+# With --max-seconds it exits 1 when the median boot time is over the limit, so it can gate CI.
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# SDKs that should only be imported on first use, never while booting
+LAZY_MODULES = ['google.generativeai', 'grpc']
+
+CHILD = """
+import json, sys, time
+start = time.perf_counter()
+from src.app import create_app
+imported = time.perf_counter()
+create_app()
+booted = time.perf_counter()
+print(json.dumps({
+    'import': imported - start,
+    'create_app': booted - imported,
+    'modules': len(sys.modules),
+    'lazy_loaded': [name for name in %r if name in sys.modules]
+}))
+""" % (LAZY_MODULES,)
+
+
+def child_env():
+    env = dict(os.environ, PYTHONPATH=BACKEND_DIR)
+    # create_app() only builds the engine, it doesn't connect
+    env.setdefault('DATABASE_URL', f"sqlite:///{os.path.join(tempfile.gettempdir(), 'bench_startup.db')}")
+    return env
+
+
+def boot_once():
+    output = subprocess.run(
+        [sys.executable, '-c', CHILD], cwd=BACKEND_DIR, env=child_env(), capture_output=True, text=True, check=True
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def slowest_imports(limit=10):
+    # -X importtime writes "import time: self | cumulative | package" lines to stderr
+    stderr = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', 'import src.app'],
+        cwd=BACKEND_DIR, env=child_env(), capture_output=True, text=True, check=True
+    ).stderr
+    rows = []
+    for line in stderr.splitlines():
+        parts = line.split('|')
+        if len(parts) == 3 and parts[1].strip().isdigit():
+            rows.append((int(parts[1]), parts[2].strip()))
+    return sorted(rows, reverse=True)[:limit]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Worker cold start benchmark')
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--max-seconds', type=float, help='fail if the median import + create_app time is higher')
+    args = parser.parse_args(argv)
+
+    runs = [boot_once() for _ in range(args.runs)]
+    imports = statistics.median(run['import'] for run in runs)
+    boots = statistics.median(run['create_app'] for run in runs)
+    total = statistics.median(run['import'] + run['create_app'] for run in runs)
+
+    print(f"import src.app   {imports * 1000:8.1f}ms (median of {args.runs})")
+    print(f"create_app()     {boots * 1000:8.1f}ms")
+    print(f"total            {total * 1000:8.1f}ms, {runs[0]['modules']} modules loaded")
+    print('\nslowest imports (cumulative, a package includes the modules it imports):')
+    for cumulative, name in slowest_imports():
+        print(f"  {cumulative / 1000:8.1f}ms  {name}")
+
+    failed = False
+    if runs[0]['lazy_loaded']:
+        print(f"\nFAIL: imported while booting: {', '.join(runs[0]['lazy_loaded'])}")
+        failed = True
+    if args.max_seconds is not None and total > args.max_seconds:
+        print(f"\nFAIL: boot took {total:.3f}s, limit is {args.max_seconds:.3f}s")
+        failed = True
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,289 @@
+import argparse
+import hashlib
+import json
+import random
+import re
+import threading
+import time
+import uuid
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+from benchmarks.bench_json import artist, track
+
+# Local stand-ins for the Spotify Web API and Gemini, for load tests that don't touch the real services.
+# Run from backend/: python -m benchmarks.stub_servers [--latency-ms 80 --error-rate 0.01 --rate-429 0.02 ...]
+# then start the app with the environment it prints.
+#
+# Spotify: GET /v1/me, /v1/me/top/{tracks,artists} (with ETags), /v1/search, /v1/tracks, /v1/me/tracks;
+# POST /v1/users/{id}/playlists and /v1/playlists/{id}/tracks (max 100 uris). Each access token is its own
+# Spotify user.
+# Gemini: the REST streamGenerateContent endpoint the SDK calls with transport='rest', streaming a JSON array
+# of chunks that together spell out a ```json song list.
+
+
+class StubConfig:
+    def __init__(self, latency_ms=50, jitter_ms=20, error_rate=0.0, rate_429=0.0, retry_after=1,
+                 not_found_rate=0.05, gemini_first_chunk_ms=400, gemini_chunk_ms=30, gemini_songs=20,
+                 song_pool=500, seed=None):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.error_rate = error_rate
+        self.rate_429 = rate_429
+        self.retry_after = retry_after
+        self.not_found_rate = not_found_rate
+        self.gemini_first_chunk_ms = gemini_first_chunk_ms
+        self.gemini_chunk_ms = gemini_chunk_ms
+        self.gemini_songs = gemini_songs
+        self.song_pool = song_pool
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.counts = {}
+
+    def count(self, name):
+        with self.lock:
+            self.counts[name] = self.counts.get(name, 0) + 1
+
+    def uniform(self):
+        with self.lock:
+            return self.random.random()
+
+    def latency(self, mean_ms, jitter_ms=None):
+        jitter_ms = self.jitter_ms if jitter_ms is None else jitter_ms
+        with self.lock:
+            return max(self.random.gauss(mean_ms, jitter_ms), 0) / 1000
+
+
+def stable_rng(*parts):
+    # same input, same fake data: top lists and search results stay consistent between requests
+    return random.Random(hashlib.sha256('|'.join(parts).encode()).hexdigest())
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    config = StubConfig()
+
+    def log_message(self, *args):
+        pass
+
+    def send_json(self, code, body, headers=None):
+        payload = json.dumps(body).encode()
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def read_json(self):
+        length = int(self.headers.get('Content-Length', 0))
+        return json.loads(self.rfile.read(length) or b'{}')
+
+    def inject_faults(self):
+        """Sleeps for the configured latency, then sends an injected 429 / 500 and returns True if one fires."""
+        time.sleep(self.config.latency(self.config.latency_ms))
+        if self.config.uniform() < self.config.rate_429:
+            self.config.count('429')
+            self.send_json(429, {'error': {'status': 429, 'message': 'API rate limit exceeded'}},
+                           {'Retry-After': str(self.config.retry_after)})
+            return True
+        if self.config.uniform() < self.config.error_rate:
+            self.config.count('500')
+            self.send_json(500, {'error': {'status': 500, 'message': 'Server error'}})
+            return True
+        return False
+
+    def access_token(self):
+        return self.headers.get('Authorization', '').removeprefix('Bearer ')
+
+
+class SpotifyStubHandler(StubHandler):
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        query = parse_qs(url.query)
+        self.config.count(f'GET {re.sub(r"/top/.*", "/top", url.path)}')
+        if self.inject_faults():
+            return
+
+        token = self.access_token()
+        if url.path == '/v1/me':
+            self.send_json(200, {'id': f'user-{hashlib.sha256(token.encode()).hexdigest()[:12]}', 'display_name': 'Bench'})
+        elif url.path in ('/v1/me/top/tracks', '/v1/me/top/artists'):
+            kind = url.path.rsplit('/', 1)[1]
+            etag = f'"{hashlib.sha256((token + kind).encode()).hexdigest()[:16]}"'
+            if self.headers.get('If-None-Match') == etag:
+                self.send_response(304)
+                self.send_header('ETag', etag)
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return
+            rng = stable_rng(token, kind)
+            items = [track(rng) for _ in range(50)] if kind == 'tracks' else [artist(rng, full=True) for _ in range(50)]
+            self.send_json(200, {'items': items, 'total': 50, 'limit': 50, 'offset': 0}, {'ETag': etag})
+        elif url.path == '/v1/search':
+            search = query.get('q', [''])[0]
+            kind = query.get('type', ['track'])[0]
+            rng = stable_rng(search, kind)
+            found = rng.random() >= self.config.not_found_rate
+            items = [track(rng) if kind == 'track' else artist(rng)] if found else []
+            self.send_json(200, {f'{kind}s': {'items': items, 'total': len(items)}})
+        elif url.path == '/v1/tracks':
+            ids = query.get('ids', [''])[0].split(',')
+            self.send_json(200, {'tracks': [dict(track(stable_rng(track_id)), id=track_id) for track_id in ids]})
+        elif url.path == '/v1/me/tracks':
+            offset = int(query.get('offset', ['0'])[0])
+            limit = int(query.get('limit', ['20'])[0])
+            total = 2000
+            rng = stable_rng(token, 'saved', str(offset))
+            items = [{'added_at': '2024-05-01T12:00:00Z', 'track': track(rng)} for _ in range(max(min(limit, total - offset), 0))]
+            self.send_json(200, {'items': items, 'total': total, 'limit': limit, 'offset': offset})
+        else:
+            self.send_json(404, {'error': {'status': 404, 'message': 'Not found'}})
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        body = self.read_json()
+        if re.fullmatch(r'/v1/users/[^/]+/playlists', url.path):
+            self.config.count('POST /v1/users/{id}/playlists')
+            if self.inject_faults():
+                return
+            self.send_json(201, {'id': uuid.uuid4().hex[:22], 'name': body.get('name')})
+        elif re.fullmatch(r'/v1/playlists/[^/]+/tracks', url.path):
+            self.config.count('POST /v1/playlists/{id}/tracks')
+            if self.inject_faults():
+                return
+            if len(body.get('uris', [])) > 100:
+                self.send_json(400, {'error': {'status': 400, 'message': 'Too many ids requested'}})
+                return
+            self.send_json(201, {'snapshot_id': uuid.uuid4().hex})
+        else:
+            self.send_json(404, {'error': {'status': 404, 'message': 'Not found'}})
+
+
+class GeminiStubHandler(StubHandler):
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        if not url.path.endswith(':streamGenerateContent'):
+            self.send_json(404, {'error': {'code': 404, 'message': 'Not found'}})
+            return
+        self.config.count('POST streamGenerateContent')
+        prompt = json.dumps(self.read_json())
+
+        time.sleep(self.config.latency(self.config.gemini_first_chunk_ms))
+        if self.config.uniform() < self.config.error_rate:
+            self.config.count('gemini 500')
+            self.send_json(500, {'error': {'code': 500, 'message': 'Internal error'}})
+            return
+
+        # as many songs as the prompt asks for; each part of a batched playlist picks from its own slice of the pool
+        count = re.search(r'Generate a (\d+)-song', prompt)
+        count = int(count.group(1)) if count else self.config.gemini_songs
+        part = re.search(r'This is part (\d+) of (\d+)', prompt)
+        first, size = 0, self.config.song_pool
+        if part:
+            size = self.config.song_pool // int(part.group(2))
+            first = size * (int(part.group(1)) - 1)
+        songs = []
+        for _ in range(count):
+            number = first + int(self.config.uniform() * size)
+            songs.append({'track': f'Song {number}', 'artist': f'Artist {number % 97}'})
+        text = '```json\n' + json.dumps(songs, indent=2) + '\n```'
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+
+        # a JSON array of GenerateContentResponse objects, a few lines of text each
+        pieces = [text[i:i + 120] for i in range(0, len(text), 120)]
+        for index, piece in enumerate(pieces):
+            chunk = {'candidates': [{'content': {'parts': [{'text': piece}], 'role': 'model'}, 'index': 0}]}
+            data = ('[' if index == 0 else ',\n') + json.dumps(chunk)
+            if index == len(pieces) - 1:
+                data += ']'
+            self.write_chunk(data.encode())
+            time.sleep(self.config.latency(self.config.gemini_chunk_ms, self.config.gemini_chunk_ms / 4))
+        self.write_chunk(b'')
+
+    def write_chunk(self, data):
+        self.wfile.write(f'{len(data):x}\r\n'.encode() + data + b'\r\n')
+        self.wfile.flush()
+
+
+def serve(handler, config, host='127.0.0.1', port=0):
+    """Starts a stub server in a background thread, returns the server (server.server_address has the port)."""
+    handler_class = type(handler.__name__, (handler,), {'config': config})
+    server = ThreadingHTTPServer((host, port), handler_class)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def start_stubs(config, host='127.0.0.1', spotify_port=8701, gemini_port=8702):
+    """Starts both stubs, returns (servers, environment variables pointing the app at them)."""
+    spotify = serve(SpotifyStubHandler, config, host, spotify_port)
+    gemini = serve(GeminiStubHandler, config, host, gemini_port)
+    env = {
+        'SPOTIFY_API_BASE_URL': f'http://{host}:{spotify.server_address[1]}/v1',
+        'GEMINI_API_ENDPOINT': f'http://{host}:{gemini.server_address[1]}',
+        'GOOGLE_API_KEY': 'stub'
+    }
+    return (spotify, gemini), env
+
+
+def add_stub_arguments(parser):
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--spotify-port', type=int, default=8701)
+    parser.add_argument('--gemini-port', type=int, default=8702)
+    parser.add_argument('--latency-ms', type=float, default=50, help='mean Spotify response time')
+    parser.add_argument('--jitter-ms', type=float, default=20, help='standard deviation of the response time')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='fraction of requests answered with a 500')
+    parser.add_argument('--rate-429', type=float, default=0.0, help='fraction of requests answered with a 429')
+    parser.add_argument('--retry-after', type=int, default=1, help='Retry-After seconds sent with a 429')
+    parser.add_argument('--not-found-rate', type=float, default=0.05, help='fraction of searches with no result')
+    parser.add_argument('--gemini-first-chunk-ms', type=float, default=400)
+    parser.add_argument('--gemini-chunk-ms', type=float, default=30)
+    parser.add_argument('--gemini-songs', type=int, default=20, help='songs per response when the prompt has no count')
+    parser.add_argument('--song-pool', type=int, default=500, help='distinct songs Gemini picks from')
+    parser.add_argument('--seed', type=int)
+
+
+def config_from_args(args):
+    return StubConfig(
+        latency_ms=args.latency_ms,
+        jitter_ms=args.jitter_ms,
+        error_rate=args.error_rate,
+        rate_429=args.rate_429,
+        retry_after=args.retry_after,
+        not_found_rate=args.not_found_rate,
+        gemini_first_chunk_ms=args.gemini_first_chunk_ms,
+        gemini_chunk_ms=args.gemini_chunk_ms,
+        gemini_songs=args.gemini_songs,
+        song_pool=args.song_pool,
+        seed=args.seed
+    )
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Spotify and Gemini stub servers')
+    add_stub_arguments(parser)
+    args = parser.parse_args(argv)
+
+    config = config_from_args(args)
+    servers, env = start_stubs(config, args.host, args.spotify_port, args.gemini_port)
+    print('Stubs running, start the app with:')
+    for name, value in env.items():
+        print(f'  export {name}={value}')
+    try:
+        while True:
+            time.sleep(10)
+    except KeyboardInterrupt:
+        print(json.dumps(config.counts, indent=2))
+        for server in servers:
+            server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,68 @@
+import multiprocessing
+import os
+import shutil
+import tempfile
+import threading
+
+# Production server config: gunicorn -c gunicorn.conf.py src.wsgi:app
+#
+# Requests spend most of their time waiting on Spotify, Gemini and Postgres, so each worker process runs a
+# pool of threads (gthread) instead of handling one request at a time. Threads share the worker's pooled
+# Spotify client, caches and rate limiter; several processes give real CPU parallelism and crash isolation.
+
+bind = f"0.0.0.0:{os.getenv('PORT', 5000)}"
+
+worker_class = 'gthread'
+workers = int(os.getenv('WEB_CONCURRENCY', min(multiprocessing.cpu_count() * 2, 8)))
+threads = int(os.getenv('GUNICORN_THREADS', 8))
+
+# Build the app once in the master, workers fork from it with the imports already done
+preload_app = os.getenv('GUNICORN_PRELOAD', 'true').lower() == 'true'
+
+# Recycle workers after a number of requests (jittered so they don't all restart at once),
+# in-flight requests get graceful_timeout seconds to finish
+max_requests = int(os.getenv('GUNICORN_MAX_REQUESTS', 1000))
+max_requests_jitter = int(os.getenv('GUNICORN_MAX_REQUESTS_JITTER', 100))
+graceful_timeout = int(os.getenv('GUNICORN_GRACEFUL_TIMEOUT', 30))
+
+# A synchronous /create_recs waits on Gemini and a few hundred Spotify calls
+timeout = int(os.getenv('GUNICORN_TIMEOUT', 120))
+keepalive = int(os.getenv('GUNICORN_KEEPALIVE', 5))
+
+# Load the Gemini SDK and open the Spotify/database connections right after fork, in the background, instead of
+# on the worker's first request
+warm_up = os.getenv('WARM_UP', 'true').lower() == 'true'
+
+accesslog = os.getenv('GUNICORN_ACCESS_LOG', '-')
+errorlog = '-'
+loglevel = os.getenv('GUNICORN_LOG_LEVEL', 'info')
+
+
+# Workers write their Prometheus samples here so /metrics can aggregate all of them (see src/metrics.py).
+# Must be set before the app (and prometheus_client) is imported.
+os.environ.setdefault('PROMETHEUS_MULTIPROC_DIR', os.path.join(tempfile.gettempdir(), 'prometheus_multiproc'))
+
+
+def on_starting(server):
+    # samples from a previous run of the server would be counted again
+    directory = os.environ['PROMETHEUS_MULTIPROC_DIR']
+    shutil.rmtree(directory, ignore_errors=True)
+    os.makedirs(directory, exist_ok=True)
+
+
+def child_exit(server, worker):
+    from prometheus_client import multiprocess
+    multiprocess.mark_process_dead(worker.pid)
+
+
+def post_fork(server, worker):
+    # database connections opened by the master (if any) must not be shared with the workers;
+    # the Spotify client and job pool reset themselves through os.register_at_fork
+    from src.extensions import db
+    app = server.app.wsgi()
+    with app.app_context():
+        db.engine.dispose(close=False)
+
+    if warm_up:
+        from src.warmup import warm_up as warm_up_worker
+        threading.Thread(target=warm_up_worker, args=(app,), name='warm-up', daemon=True).start()
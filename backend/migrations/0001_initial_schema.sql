@@ -0,0 +1,57 @@
+-- Tables from database/init-scripts/schema.sql.
+-- IF NOT EXISTS so this is a no-op on databases created by the docker init script.
+
+CREATE TABLE IF NOT EXISTS users (
+    id UUID PRIMARY KEY DEFAULT gen_random_uuid(),
+    spotify_id TEXT UNIQUE NOT NULL,
+    email TEXT UNIQUE,
+    display_name TEXT,
+    profile_image TEXT,
+    created_at TIMESTAMP DEFAULT NOW()
+);
+
+CREATE TABLE IF NOT EXISTS prompts (
+    id UUID PRIMARY KEY DEFAULT gen_random_uuid(),
+    user_id UUID REFERENCES users(id) ON DELETE CASCADE,
+    mood TEXT NOT NULL,
+    additional_notes TEXT,
+    created_at TIMESTAMP DEFAULT NOW()
+);
+
+CREATE TABLE IF NOT EXISTS playlists (
+    id UUID PRIMARY KEY DEFAULT gen_random_uuid(),
+    user_id UUID REFERENCES users(id) ON DELETE CASCADE,
+    prompt_id UUID UNIQUE NOT NULL REFERENCES prompts(id) ON DELETE CASCADE,
+    spotify_playlist_id TEXT UNIQUE NOT NULL,
+    playlist_name TEXT NOT NULL,
+    created_at TIMESTAMP DEFAULT NOW()
+);
+
+CREATE TABLE IF NOT EXISTS playlist_tracks (
+    playlist_id UUID REFERENCES playlists(id) ON DELETE CASCADE,
+    spotify_track_id TEXT NOT NULL,
+    track_name TEXT NOT NULL,
+    artist_name TEXT NOT NULL,
+    PRIMARY KEY (playlist_id, spotify_track_id)
+);
+
+CREATE TABLE IF NOT EXISTS track_resolutions (
+    lookup_key TEXT PRIMARY KEY,
+    spotify_track_id TEXT,
+    spotify_uri TEXT,
+    resolved_at TIMESTAMP DEFAULT NOW(),
+    last_used_at TIMESTAMP DEFAULT NOW()
+);
+
+CREATE TABLE IF NOT EXISTS rec_jobs (
+    id UUID PRIMARY KEY DEFAULT gen_random_uuid(),
+    user_id UUID NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+    prompt TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'queued',
+    stage TEXT,
+    stages JSONB NOT NULL DEFAULT '[]',
+    result JSONB,
+    status_code INTEGER,
+    created_at TIMESTAMP DEFAULT NOW(),
+    updated_at TIMESTAMP DEFAULT NOW()
+);
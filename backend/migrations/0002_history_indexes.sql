@@ -0,0 +1,11 @@
+-- Indexes for the user_id lookups behind the history endpoints and the ON DELETE CASCADE from users.
+
+-- prompt history: WHERE user_id = ? ORDER BY created_at DESC, id DESC, and the keyset (created_at, id) < cursor
+CREATE INDEX IF NOT EXISTS prompts_user_id_created_at_idx ON prompts (user_id, created_at, id);
+
+CREATE INDEX IF NOT EXISTS playlists_user_id_idx ON playlists (user_id);
+
+CREATE INDEX IF NOT EXISTS rec_jobs_user_id_idx ON rec_jobs (user_id);
+
+-- least recently used pruning of the shared track resolution cache
+CREATE INDEX IF NOT EXISTS track_resolutions_last_used_at_idx ON track_resolutions (last_used_at);
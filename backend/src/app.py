@@ -1,6 +1,9 @@
 from flask import Flask
 from flask_cors import CORS
 from src.extensions import db
+from src.db_pool import install_engine_hooks
+from src.metrics import init_metrics
+from src.profiler import init_profiler
 from src.routes import init_routes
 from logging.config import dictConfig
 from src.logger import init_logger
@@ -22,12 +25,21 @@ def create_app():
 
     # Initialize extensions
     db.init_app(app)
+    with app.app_context():
+        install_engine_hooks(
+            db.engine,
+            statement_timeout_ms=app.config['DB_STATEMENT_TIMEOUT_MS'],
+            pgbouncer=app.config['DB_PGBOUNCER']
+        )
     
     # Initialize routes
     api = init_routes(app)
+    init_metrics(app)
+    init_profiler(app)
 
     return app
 
 if __name__ == '__main__':
+    # development server only, production runs src.wsgi:app under gunicorn (see gunicorn.conf.py)
     app = create_app()
-    app.run(debug=True, host='0.0.0.0')
\ No newline at end of file
+    app.run(debug=os.getenv('FLASK_DEBUG', 'false').lower() == 'true', host='0.0.0.0')
\ No newline at end of file
@@ -0,0 +1,93 @@
+import threading
+import time
+from collections import OrderedDict
+
+# In-process caches shared by request handlers and worker threads
+
+# returned by TTLCache.get when a key isn't cached, so None can be cached as a value
+MISSING = object()
+
+
+class TTLCache:
+    """
+    Thread-safe LRU cache with a time to live per entry.
+    Once max_size entries are stored the least recently used one is evicted; ttl=None keeps entries until then.
+    Hits, misses and evictions are counted for metrics.
+    """
+
+    def __init__(self, max_size=1024, ttl=None):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._data = OrderedDict()  # key -> (expires_at, value)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, default=MISSING):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None:
+                expires_at, value = entry
+                if expires_at is None or expires_at > now:
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._data[key]
+            self.misses += 1
+            return default
+
+    def set(self, key, value, ttl=MISSING):
+        if ttl is MISSING:
+            ttl = self.ttl
+        expires_at = time.monotonic() + ttl if ttl is not None else None
+        with self._lock:
+            self._data[key] = (expires_at, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'size': len(self._data),
+            'max_size': self.max_size,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'hit_rate': self.hits / lookups if lookups else 0.0
+        }
+
+
+# Registry of the process-wide caches, so they can be shared by every request and reported together
+_caches = {}
+_caches_lock = threading.Lock()
+
+
+def get_cache(name, factory):
+    """Returns the cache registered under name, building it with factory() on first use."""
+    cache = _caches.get(name)
+    if cache is None:
+        with _caches_lock:
+            cache = _caches.get(name)
+            if cache is None:
+                cache = factory()
+                _caches[name] = cache
+    return cache
+
+
+def cache_stats():
+    return {name: cache.stats() for name, cache in list(_caches.items())}
@@ -1,5 +1,6 @@
 import os
 from dotenv import load_dotenv
+from src.db_pool import build_engine_options
 
 # Below code AI Generated with ChatGPT for efficiency / having it split up the original app.py
 
@@ -9,4 +10,87 @@ load_dotenv(dotenv_path=os.path.join(os.path.dirname(__file__), '.env'))
 class Config:
     # Access the DATABASE_URL environment variable
     SQLALCHEMY_DATABASE_URI = os.getenv('DATABASE_URL')
-    SQLALCHEMY_TRACK_MODIFICATIONS = False
\ No newline at end of file
+    SQLALCHEMY_TRACK_MODIFICATIONS = False
+
+    # Connection pool, per worker process. Behind PgBouncer (transaction pooling) set DB_PGBOUNCER=true
+    DB_POOL_SIZE = int(os.getenv('DB_POOL_SIZE', 5))
+    DB_MAX_OVERFLOW = int(os.getenv('DB_MAX_OVERFLOW', 10))
+    # seconds to wait for a free connection (whole seconds, the engine coerces pool_timeout to int)
+    DB_POOL_TIMEOUT = int(os.getenv('DB_POOL_TIMEOUT', 30))
+    DB_POOL_RECYCLE = int(os.getenv('DB_POOL_RECYCLE', 1800))
+    DB_POOL_PRE_PING = os.getenv('DB_POOL_PRE_PING', 'true').lower() == 'true'
+    # Per-statement timeout in milliseconds, 0 = no timeout
+    DB_STATEMENT_TIMEOUT_MS = int(os.getenv('DB_STATEMENT_TIMEOUT_MS', 0))
+    DB_PGBOUNCER = os.getenv('DB_PGBOUNCER', 'false').lower() == 'true'
+
+    SQLALCHEMY_ENGINE_OPTIONS = build_engine_options(
+        SQLALCHEMY_DATABASE_URI,
+        pool_size=DB_POOL_SIZE,
+        max_overflow=DB_MAX_OVERFLOW,
+        pool_timeout=DB_POOL_TIMEOUT,
+        pool_recycle=DB_POOL_RECYCLE,
+        pool_pre_ping=DB_POOL_PRE_PING,
+        statement_timeout_ms=DB_STATEMENT_TIMEOUT_MS,
+        pgbouncer=DB_PGBOUNCER
+    )
+
+    # Max number of concurrent Spotify track lookups per /create_recs request (1 = one at a time)
+    SPOTIFY_SEARCH_CONCURRENCY = int(os.getenv('SPOTIFY_SEARCH_CONCURRENCY', 8))
+
+    # (track, artist) -> Spotify URI resolution cache: 'memory' (per worker), 'postgres' (shared) or 'none'
+    TRACK_CACHE_BACKEND = os.getenv('TRACK_CACHE_BACKEND', 'memory')
+    TRACK_CACHE_MAX_SIZE = int(os.getenv('TRACK_CACHE_MAX_SIZE', 10000))
+    TRACK_CACHE_TTL = int(os.getenv('TRACK_CACHE_TTL', 7 * 24 * 3600))
+    TRACK_CACHE_NEGATIVE_TTL = int(os.getenv('TRACK_CACHE_NEGATIVE_TTL', 3600))
+    # Streamed recommendations looked up per query against the postgres backend, and the longest (seconds) the
+    # first of them waits for the batch to fill before it's looked up anyway
+    TRACK_CACHE_LOOKUP_BATCH = int(os.getenv('TRACK_CACHE_LOOKUP_BATCH', 25))
+    TRACK_CACHE_LOOKUP_WAIT = float(os.getenv('TRACK_CACHE_LOOKUP_WAIT', 0.05))
+
+    # Per-user cache of Spotify top tracks/artists, stale entries are revalidated with ETags
+    TOP_DATA_CACHE_TTL = int(os.getenv('TOP_DATA_CACHE_TTL', 6 * 3600))
+    TOP_DATA_CACHE_MAX_USERS = int(os.getenv('TOP_DATA_CACHE_MAX_USERS', 1000))
+
+    # Background workers for asynchronous /create_recs jobs (per process)
+    REC_JOB_WORKERS = int(os.getenv('REC_JOB_WORKERS', 4))
+    # A queued/running job with no progress for this many seconds is reported failed (its worker went away)
+    REC_JOB_STALE_SECONDS = int(os.getenv('REC_JOB_STALE_SECONDS', 600))
+
+    # Cache of Gemini recommendation lists, keyed on the prompt and the user's top artists/tracks
+    GEMINI_CACHE_MAX_SIZE = int(os.getenv('GEMINI_CACHE_MAX_SIZE', 2000))
+    GEMINI_CACHE_TTL = int(os.getenv('GEMINI_CACHE_TTL', 6 * 3600))
+
+    # Playlist size for /create_recs: default and max songs a request can ask for (playlist_size)
+    PLAYLIST_SIZE_DEFAULT = int(os.getenv('PLAYLIST_SIZE_DEFAULT', 20))
+    PLAYLIST_SIZE_MAX = int(os.getenv('PLAYLIST_SIZE_MAX', 500))
+    # Songs per Gemini generation; larger playlists are generated as several parts, GEMINI_BATCH_CONCURRENCY at once
+    GEMINI_BATCH_SIZE = int(os.getenv('GEMINI_BATCH_SIZE', 50))
+    GEMINI_BATCH_CONCURRENCY = int(os.getenv('GEMINI_BATCH_CONCURRENCY', 6))
+    # Most prompts (playlists) one /create_recs/batch request can ask for
+    CREATE_RECS_BATCH_MAX_PROMPTS = int(os.getenv('CREATE_RECS_BATCH_MAX_PROMPTS', 10))
+    # Most songs (prompts x playlist_size) one /create_recs/batch request can ask for; the batch runs inside the
+    # request and each song is a Spotify search, so this keeps it well under the gunicorn timeout
+    CREATE_RECS_BATCH_MAX_SONGS = int(os.getenv('CREATE_RECS_BATCH_MAX_SONGS', 200))
+    # Playlists /create_recs/batch creates and fills at the same time (each playlist's tracks go in one by one)
+    CREATE_RECS_BATCH_CONCURRENCY = int(os.getenv('CREATE_RECS_BATCH_CONCURRENCY', 4))
+
+    # Upper bound on the estimated input tokens of the Gemini prompt, lowest ranked taste data is dropped to fit
+    GEMINI_PROMPT_TOKEN_BUDGET = int(os.getenv('GEMINI_PROMPT_TOKEN_BUDGET', 1200))
+
+    # Saved-track pages fetched at the same time when streaming a whole library (/api/spotify/saved_tracks?all=true)
+    SAVED_TRACKS_CONCURRENCY = int(os.getenv('SAVED_TRACKS_CONCURRENCY', 4))
+
+    # Prompt history pages (/get_prompts, /get_prompts_by_spotify_id): default and max page size
+    PROMPT_HISTORY_PAGE_SIZE = int(os.getenv('PROMPT_HISTORY_PAGE_SIZE', 50))
+    PROMPT_HISTORY_MAX_PAGE_SIZE = int(os.getenv('PROMPT_HISTORY_MAX_PAGE_SIZE', 200))
+
+    # Encoder for API responses: 'orjson' (falls back to json when orjson isn't installed) or 'json'
+    JSON_BACKEND = os.getenv('JSON_BACKEND', 'orjson')
+
+    # Opt-in request profiler (src/profiler.py): requests sending X-Profile-Token: <PROFILE_TOKEN>, and a
+    # PROFILE_SAMPLE_RATE fraction of all requests, get CPU (pstats) and wall-clock (speedscope) profiles
+    # written to PROFILE_DIR. Off when neither is set.
+    PROFILE_TOKEN = os.getenv('PROFILE_TOKEN')
+    PROFILE_SAMPLE_RATE = float(os.getenv('PROFILE_SAMPLE_RATE', 0))
+    PROFILE_DIR = os.getenv('PROFILE_DIR', '/tmp/profiles')
+    PROFILE_WALL_INTERVAL = float(os.getenv('PROFILE_WALL_INTERVAL', 0.005))
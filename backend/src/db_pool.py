@@ -0,0 +1,115 @@
+import threading
+import time
+from sqlalchemy import event
+from sqlalchemy.engine import make_url
+from sqlalchemy.pool import QueuePool
+
+# SQLAlchemy engine options built from environment variables (see config.py), and pool usage counters.
+
+
+class TimedQueuePool(QueuePool):
+    """
+    QueuePool that also counts checkouts and how long requests waited on an exhausted pool.
+    A checkout is counted as waiting when every pooled and overflow connection was already checked out.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._stats_lock = threading.Lock()
+        self.checkouts = 0
+        self.waited = 0
+        self.wait_seconds = 0.0
+        self.max_wait_seconds = 0.0
+        self.timeouts = 0
+
+    def _exhausted(self):
+        return self._pool.empty() and self._max_overflow > -1 and self._overflow >= self._max_overflow
+
+    def _do_get(self):
+        exhausted = self._exhausted()
+        start = time.monotonic()
+        try:
+            return super()._do_get()
+        except Exception:
+            # sqlalchemy.exc.TimeoutError once pool_timeout runs out
+            if exhausted:
+                with self._stats_lock:
+                    self.timeouts += 1
+            raise
+        finally:
+            waited = time.monotonic() - start
+            with self._stats_lock:
+                self.checkouts += 1
+                if exhausted:
+                    self.waited += 1
+                    self.wait_seconds += waited
+                    self.max_wait_seconds = max(self.max_wait_seconds, waited)
+
+    def stats(self):
+        return {
+            'size': self.size(),
+            'checked_out': self.checkedout(),
+            'checked_in': self.checkedin(),
+            'overflow': max(self.overflow(), 0),
+            'max_overflow': self._max_overflow,
+            'checkouts': self.checkouts,
+            'waited': self.waited,
+            'wait_seconds': self.wait_seconds,
+            'max_wait_seconds': self.max_wait_seconds,
+            'timeouts': self.timeouts
+        }
+
+
+def build_engine_options(database_url, pool_size=5, max_overflow=10, pool_timeout=30, pool_recycle=1800,
+                         pool_pre_ping=True, statement_timeout_ms=0, pgbouncer=False):
+    """
+    Returns SQLALCHEMY_ENGINE_OPTIONS.
+    statement_timeout_ms=0 leaves Postgres' default (no timeout). Normally the timeout is set once per connection
+    as a startup option; PgBouncer rejects startup options and, in transaction pooling mode, hands every
+    transaction a different server connection, so in pgbouncer mode it is set with SET LOCAL at the start of
+    each transaction instead (install_engine_hooks) and server-side prepared statements are turned off.
+    """
+    options = {
+        'poolclass': TimedQueuePool,
+        'pool_size': pool_size,
+        'max_overflow': max_overflow,
+        'pool_timeout': pool_timeout,
+        'pool_recycle': pool_recycle,
+        'pool_pre_ping': pool_pre_ping
+    }
+    if not database_url:
+        return options
+
+    url = make_url(database_url)
+    if not url.get_backend_name().startswith('postgresql'):
+        return options
+
+    connect_args = {}
+    if pgbouncer:
+        # psycopg 3 prepares statements server side after a few executions, which breaks when the next
+        # transaction lands on another server connection; psycopg2 never prepares, so needs nothing
+        if url.get_driver_name() == 'psycopg':
+            connect_args['prepare_threshold'] = None
+    elif statement_timeout_ms:
+        connect_args['options'] = f'-c statement_timeout={int(statement_timeout_ms)}'
+
+    if connect_args:
+        options['connect_args'] = connect_args
+    return options
+
+
+def install_engine_hooks(engine, statement_timeout_ms=0, pgbouncer=False):
+    """Sets the per-transaction statement timeout in pgbouncer mode (see build_engine_options)."""
+    if not (pgbouncer and statement_timeout_ms) or engine.dialect.name != 'postgresql':
+        return
+
+    @event.listens_for(engine, 'begin')
+    def set_statement_timeout(conn):
+        conn.exec_driver_sql(f'SET LOCAL statement_timeout = {int(statement_timeout_ms)}')
+
+
+def pool_stats(engine):
+    pool = engine.pool
+    if isinstance(pool, TimedQueuePool):
+        return dict(pool.stats(), pool='queue')
+    return {'pool': type(pool).__name__, 'status': pool.status()}
@@ -0,0 +1,38 @@
+import hashlib
+from flask import request, Response
+
+# Conditional GET support for the read endpoints.
+# The ETag is a hash of a row version probe (queries.py), so a request whose If-None-Match still matches gets a
+# 304 without the objects being loaded or serialized.
+
+# bump when a response format changes, so clients don't keep a body cached under the old format
+ETAG_FORMAT_VERSION = 1
+
+
+def make_etag(*parts):
+    return hashlib.sha256('|'.join(str(part) for part in (ETAG_FORMAT_VERSION,) + parts).encode()).hexdigest()
+
+
+def check_etag(version, *key):
+    """
+    Returns (etag, response): the etag for this version of the resource identified by key, and a 304 response
+    when the client already has it (None otherwise). A None version (no probe available) gives (None, None).
+    """
+    if version is None:
+        return None, None
+    etag = make_etag(*key, version)
+    if request.if_none_match.contains_weak(etag):
+        return etag, not_modified(etag)
+    return etag, None
+
+
+def not_modified(etag):
+    response = Response(status=304)
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+
+def etag_headers(etag):
+    # no-cache: browsers may keep the body but have to revalidate it with If-None-Match every time
+    return {'ETag': f'"{etag}"', 'Cache-Control': 'no-cache'} if etag else {}
@@ -1,56 +1,306 @@
 import os
-# TODO: google.generativeai is now deprecated; try to use google.genai instead
-import google.generativeai as genai
 import json
 import re
+import hashlib
+import threading
+import queue
+from concurrent.futures import ThreadPoolExecutor
+from contextvars import copy_context
+from flask import current_app
+import time
+from src.cache import TTLCache, MISSING, get_cache
+from src.metrics import observe_stage, observe_outbound
+from src.logger import logger
 
 GEMINI_API_KEY = os.environ.get("GOOGLE_API_KEY")
-if GEMINI_API_KEY:
-    genai.configure(api_key=GEMINI_API_KEY)
-else:
+if not GEMINI_API_KEY:
     print("Warning: GOOGLE_API_KEY environment variable not set.")
 
+GEMINI_MODEL = os.environ.get("GEMINI_MODEL", "gemini-2.0-flash")
+# Alternative API endpoint, e.g. the local stub in benchmarks/stub_servers.py; uses the REST transport
+GEMINI_API_ENDPOINT = os.environ.get("GEMINI_API_ENDPOINT")
+
 prompt_template = """
-Generate a 20-song music playlist based on the following theme/mood/style: "{theme}".
+Generate a {count}-song music playlist based on the following theme/mood/style: "{theme}".
 
-The user's top artists and top tracks are provided below in JSON format.
+The user's top artists and top tracks are provided below, one per line, most listened first. Artists list their genres by the numbers in the Genres line.
 
 User's Top Artists:
-{artists_json}
+{artists}
 
 User's Top Tracks:
-{tracks_json}
+{tracks}
 
 - The playlist should only include relevant songs from the user's top artists and tracks ONLY if they match the theme. Prioritize using the user's top artists and artists which are related to them. To determine song/artist relevance, consider genre and thematic content of the song or the artist's discography.
 - Keep all song choices cohesive to the mood. Must be as accurate as possible both in sound and in theme. Choices must be defendable.
-- Output only a list of 20 songs in this JSON format:
+{part_note}- Output only a list of {count} songs in this JSON format:
 
 [
     {{ "track": "Track Title", "artist": "Artist Name" }},
     ...
 ]
 
-Do not include any explanation or other text, only the list of 20 songs.
+Do not include any explanation or other text, only the list of {count} songs.
 """
 
-def get_gemini_recommendation(prompt_input, top_artists, top_tracks):
-    model = genai.GenerativeModel("gemini-2.0-flash")
+# GenerativeModel holds no per-request state, so one is built per process and reused
+_model = None
+_model_lock = threading.Lock()
+
+def get_model():
+    global _model
+    if _model is None:
+        with _model_lock:
+            if _model is None:
+                # the SDK (grpc, protobuf, google-api-core) takes about a second to import, so it's loaded on first
+                # use (or by warmup.warm_up after fork) instead of while every worker boots
+                # TODO: google.generativeai is now deprecated; try to use google.genai instead
+                import google.generativeai as genai
+                if GEMINI_API_ENDPOINT:
+                    genai.configure(api_key=GEMINI_API_KEY, transport='rest',
+                                    client_options={'api_endpoint': GEMINI_API_ENDPOINT})
+                elif GEMINI_API_KEY:
+                    genai.configure(api_key=GEMINI_API_KEY)
+                _model = genai.GenerativeModel(GEMINI_MODEL)
+    return _model
+
+
+class GeminiError(Exception):
+    pass
+
+
+class RecommendationStreamParser:
+    """
+    Incremental parser for the streamed JSON list of {"track", "artist"} objects.
+    feed() takes each new chunk of text and returns the objects completed by it, so they can be used before the
+    rest of the list arrives. Code fences and the surrounding [ ] are skipped, only top level { } objects are parsed.
+    """
+
+    def __init__(self):
+        self.raw_text = ''
+        self._object = []  # characters of the object being read
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+
+    def feed(self, text):
+        self.raw_text += text
+        completed = []
+        for char in text:
+            if self._depth:
+                self._object.append(char)
+
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif char == '\\':
+                    self._escape = True
+                elif char == '"':
+                    self._in_string = False
+            elif char == '"' and self._depth:
+                self._in_string = True
+            elif char == '{':
+                if not self._depth:
+                    self._object = [char]
+                self._depth += 1
+            elif char == '}' and self._depth:
+                self._depth -= 1
+                if not self._depth:
+                    try:
+                        obj = json.loads(''.join(self._object))
+                    except json.JSONDecodeError:
+                        obj = None
+                    if isinstance(obj, dict):
+                        completed.append(obj)
+                    self._object = []
+        return completed
 
-    filled_prompt = prompt_template.format(
-        theme=prompt_input,
-        artists_json=top_artists,
-        tracks_json=top_tracks
+
+# Cache of finished recommendation lists, keyed on the prompt and the user's taste data
+def get_recommendation_cache():
+    config = current_app.config
+    return get_cache('gemini_recommendations', lambda: TTLCache(
+        max_size=config.get('GEMINI_CACHE_MAX_SIZE', 2000),
+        ttl=config.get('GEMINI_CACHE_TTL', 6 * 3600)
+    ))
+
+
+def recommendation_cache_key(prompt_input, top_artists, top_tracks, variant=''):
+    """Normalized prompt plus a fingerprint of the encoded top artists/tracks sent with it (and the list size/part)."""
+    prompt_key = ' '.join(prompt_input.casefold().split()).strip(' .!?')
+    fingerprint = hashlib.sha256(f"{top_artists}\n{top_tracks}".encode()).hexdigest()
+    return f"{prompt_key}:{fingerprint}:{variant}" if variant else f"{prompt_key}:{fingerprint}"
+
+
+def part_note(part, parts, total):
+    """Prompt line for one of several generations that together make up a large playlist."""
+    if parts <= 1:
+        return ''
+    return (
+        f"- This is part {part} of {parts} of a {total}-song playlist, the other parts are generated separately. "
+        f"Spread the parts over the theme so they don't repeat each other: part 1 has the closest fits, each later "
+        f"part goes further into deeper cuts and related artists.\n"
     )
 
-    try:
-        response = model.generate_content(filled_prompt, stream=True)
-        raw_response_parts = []
-        for chunk in response:
-            if chunk.parts:
-                for part in chunk.parts:
-                    raw_response_parts.append(part)
-        return raw_response_parts  # Return the raw list of parts
-
-    except Exception as e:
-        print(f"Error generating content from Gemini: {e}")
-        return {"error": f"Gemini API error: {e}"}
+
+class GeminiRecommendationStream:
+    """
+    Iterates over the recommendations as Gemini generates them, each {track, artist} is yielded as soon as it's
+    complete in the stream. Afterwards raw_text has the full response and recommendations everything yielded.
+    With a cache, a previous list for the same prompt and taste data is replayed instead (cached is set), and a
+    completed generation is stored. Raises GeminiError if the API call fails.
+    count is the number of songs asked for; part/parts/total mark it as one generation of a batched playlist.
+    """
+
+    def __init__(self, prompt_input, top_artists, top_tracks, cache=None, count=20, part=1, parts=1, total=None):
+        self.prompt = prompt_template.format(
+            theme=prompt_input,
+            artists=top_artists,
+            tracks=top_tracks,
+            count=count,
+            part_note=part_note(part, parts, total or count)
+        )
+        self.cache = cache
+        variant = '' if count == 20 and parts == 1 else f"{count}:{part}/{parts}"
+        self.cache_key = recommendation_cache_key(prompt_input, top_artists, top_tracks, variant)
+        self.cached = False
+        self.parser = RecommendationStreamParser()
+        self.recommendations = []
+        # seconds from the request to the first streamed chunk / the end of the stream (None when cached)
+        self.first_token_seconds = None
+        self.completion_seconds = None
+
+    @property
+    def raw_text(self):
+        return self.parser.raw_text
+
+    def __iter__(self):
+        if self.cache is not None:
+            cached = self.cache.get(self.cache_key)
+            if cached is not MISSING:
+                self.cached = True
+                self.parser.raw_text = json.dumps(cached)
+                for rec in cached:
+                    self.recommendations.append(rec)
+                    yield rec
+                return
+
+        model = get_model()
+        start = time.perf_counter()
+        try:
+            response = model.generate_content(self.prompt, stream=True)
+            for chunk in response:
+                if self.first_token_seconds is None:
+                    self.first_token_seconds = time.perf_counter() - start
+                    observe_stage('gemini_first_token', self.first_token_seconds)
+                for part in chunk.parts or []:
+                    for rec in self.parser.feed(getattr(part, 'text', '') or ''):
+                        self.recommendations.append(rec)
+                        yield rec
+        except Exception as e:
+            logger.warning(f"Error generating content from Gemini: {e}")
+            # google.api_core errors carry the HTTP status in .code
+            status = getattr(e, 'code', None)
+            observe_outbound('gemini', 'generate_content', status if isinstance(status, int) else 'error',
+                             time.perf_counter() - start)
+            raise GeminiError(f"Gemini API error: {e}")
+
+        self.completion_seconds = time.perf_counter() - start
+        observe_stage('gemini_complete', self.completion_seconds)
+        observe_outbound('gemini', 'generate_content', 200, self.completion_seconds)
+
+        if self.cache is not None and self.recommendations:
+            self.cache.set(self.cache_key, list(self.recommendations))
+
+
+class BatchedRecommendationStream:
+    """
+    Several recommendation streams generated at the same time (max_workers at once): the parts of a playlist
+    larger than one generation, or the playlists of a batch. Recommendations are yielded as they arrive from any
+    part; with a key, a song already yielded (same key(rec)) is skipped, recs whose key is None (invalid ones)
+    are passed through. Afterwards recommendations is in part order and position(rec) gives each yielded rec's
+    (part index, index in part). A part that fails is logged and left out (failed maps its index to the
+    GeminiError); GeminiError is raised only when every part failed.
+    """
+
+    def __init__(self, streams, key=None, max_workers=4):
+        self.streams = streams
+        self.key = key
+        self.max_workers = max_workers
+        self.positions = {}  # id(rec) -> (part index, index in part)
+        self.failed = {}
+
+    @property
+    def cached(self):
+        return all(stream.cached for stream in self.streams)
+
+    @property
+    def raw_text(self):
+        return '\n'.join(stream.raw_text for stream in self.streams)
+
+    @property
+    def recommendations(self):
+        recs = [rec for stream in self.streams for rec in stream.recommendations if id(rec) in self.positions]
+        return sorted(recs, key=self.position)
+
+    @property
+    def first_token_seconds(self):
+        times = [stream.first_token_seconds for stream in self.streams if stream.first_token_seconds is not None]
+        return min(times) if times else None
+
+    @property
+    def completion_seconds(self):
+        times = [stream.completion_seconds for stream in self.streams if stream.completion_seconds is not None]
+        return max(times) if times else None
+
+    def position(self, rec):
+        return self.positions.get(id(rec), (len(self.streams), 0))
+
+    def _drain(self, index, results):
+        try:
+            for rec in self.streams[index]:
+                results.put((index, rec, None))
+        except Exception as e:
+            # anything else is reported too, so __iter__ never waits on a part that's gone
+            results.put((index, None, e if isinstance(e, GeminiError) else GeminiError(f"Gemini API error: {e}")))
+            return
+        results.put((index, None, None))
+
+    def __iter__(self):
+        results = queue.Queue()
+        seen = set()
+        counts = [0] * len(self.streams)
+        with ThreadPoolExecutor(max_workers=max(1, self.max_workers)) as executor:
+            for index in range(len(self.streams)):
+                # copy_context keeps the caller's request priority (see rate_limiter) on the worker thread
+                executor.submit(copy_context().run, self._drain, index, results)
+            remaining = len(self.streams)
+            while remaining:
+                index, rec, error = results.get()
+                if rec is None:
+                    remaining -= 1
+                    if error is not None:
+                        logger.warning(f"Gemini part {index + 1} of {len(self.streams)} failed: {error}")
+                        self.failed[index] = error
+                    continue
+                key = self.key(rec) if self.key is not None else None
+                if key is not None:
+                    if key in seen:
+                        continue
+                    seen.add(key)
+                self.positions[id(rec)] = (index, counts[index])
+                counts[index] += 1
+                yield rec
+
+        if len(self.failed) == len(self.streams):
+            raise next(iter(self.failed.values()))
+
+
+def parse_recommendations(full_text):
+    """Parses a complete Gemini response (optionally inside a ```json fence), raises json.JSONDecodeError."""
+    json_match = re.search(r"```(?:json)?\n?([\s\S]*?)\n?```", full_text, re.DOTALL)
+    if json_match:
+        json_string = json_match.group(1).strip()
+    else:
+        json_string = full_text.strip()
+    return json.loads(json_string)
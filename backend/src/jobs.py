@@ -0,0 +1,136 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from sqlalchemy import select, update, func
+from src.extensions import db
+from src.models import User, RecJob
+from src.logger import logger
+from src.recs_pipeline import run_create_recs
+from src.rate_limiter import request_priority, BACKGROUND
+
+# Background worker pool for asynchronous /create_recs jobs.
+# The job row lives in rec_jobs; the access token is only held in memory by the worker, never stored.
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_job_executor(max_workers):
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='rec-job')
+    return _executor
+
+
+def reset_job_executor():
+    # worker threads don't survive a fork, the child builds its own pool on first use
+    global _executor, _executor_lock
+    _executor = None
+    _executor_lock = threading.Lock()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=reset_job_executor)
+
+
+def update_job(job_id, **values):
+    """
+    Writes job progress on its own connection and transaction, so it doesn't commit (or get rolled back with)
+    the pipeline's pending session changes. updated_at comes from the database clock, like its server default,
+    so expire_stale_job compares times from one clock whatever the server's timezone.
+    """
+    values['updated_at'] = func.now()
+    with db.engine.begin() as conn:
+        conn.execute(update(RecJob.__table__).where(RecJob.__table__.c.id == job_id).values(**values))
+
+
+def submit_create_recs_job(app, job_id, user_id, prompt, access_token, use_cache=True, playlist_size=None):
+    executor = get_job_executor(app.config.get('REC_JOB_WORKERS', 4))
+    executor.submit(run_create_recs_job, app, job_id, user_id, prompt, access_token, use_cache, playlist_size)
+
+
+def run_create_recs_job(app, job_id, user_id, prompt, access_token, use_cache=True, playlist_size=None):
+    with app.app_context():
+        stages = []
+
+        def on_stage(stage):
+            stages.append({'stage': stage, 'started_at': datetime.now(timezone.utc).isoformat()})
+            try:
+                update_job(job_id, stage=stage, stages=list(stages))
+            except Exception:
+                # progress is best effort, a failed write shouldn't fail the playlist
+                logger.exception(f"Could not record stage {stage} for create_recs job {job_id}")
+
+        try:
+            update_job(job_id, status='running')
+            user = db.session.get(User, user_id)
+            # jobs yield to interactive requests for Spotify rate limit tokens
+            with request_priority(BACKGROUND):
+                body, status_code = run_create_recs(user, prompt, access_token, on_stage=on_stage, use_cache=use_cache,
+                                                        playlist_size=playlist_size)
+        except Exception as e:
+            logger.exception(f"create_recs job {job_id} failed")
+            db.session.rollback()
+            body, status_code = {'error': str(e)}, 500
+        else:
+            if status_code >= 400:
+                # same as an aborted request: nothing the pipeline flushed is kept
+                db.session.rollback()
+        finally:
+            db.session.remove()
+
+        update_job(
+            job_id,
+            status='succeeded' if status_code < 400 else 'failed',
+            result=body,
+            status_code=status_code
+        )
+
+
+def expire_stale_job(job, timeout):
+    """
+    Marks a queued/running job failed when it hasn't been updated for timeout seconds: its worker was recycled,
+    killed or redeployed and will never finish it. The update only applies if the row is still stale, so a job
+    that just made progress isn't touched. Returns True if the job was expired.
+    """
+    if job.status not in ('queued', 'running'):
+        return False
+
+    # compared in the database, against the same clock that wrote updated_at; a read first, so polling a live
+    # job doesn't write (and lock) its row each time
+    cutoff = func.now() - timedelta(seconds=timeout)
+    table = RecJob.__table__
+    with db.engine.begin() as conn:
+        stale = conn.execute(select(table.c.updated_at < cutoff).where(table.c.id == job.id)).scalar()
+        if not stale:
+            return False
+        expired = conn.execute(
+            update(table)
+            .where(table.c.id == job.id, table.c.status.in_(['queued', 'running']), table.c.updated_at < cutoff)
+            .values(
+                status='failed',
+                status_code=500,
+                result={'error': 'Job was interrupted before it finished, please try again'},
+                updated_at=func.now()
+            )
+        ).rowcount
+    if expired:
+        logger.warning(f"create_recs job {job.id} expired after {timeout}s without progress")
+        db.session.refresh(job)
+    return bool(expired)
+
+
+def serialize_job(job):
+    return {
+        'job_id': str(job.id),
+        'status': job.status,
+        'stage': job.stage,
+        'stages': job.stages,
+        'status_code': job.status_code,
+        'result': job.result,
+        'created_at': job.created_at.isoformat() if job.created_at else None,
+        'updated_at': job.updated_at.isoformat() if job.updated_at else None
+    }
@@ -0,0 +1,40 @@
+import json
+from datetime import date, datetime
+from uuid import UUID
+from flask import make_response, current_app
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# JSON output representation for the flask_restx Api (see init_routes).
+# orjson serializes the large Spotify payloads (/api/spotify/top, saved tracks, playlist track lists) several
+# times faster than the json module (see benchmarks/bench_json.py); without orjson installed, or with
+# JSON_BACKEND=json, it falls back to json.dumps. Both give the same JSON values, and datetimes / UUIDs are
+# written the same way by both (datetime.isoformat() and str(uuid)).
+
+
+def json_default(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    if isinstance(value, UUID):
+        return str(value)
+    raise TypeError(f'Object of type {type(value).__name__} is not JSON serializable')
+
+
+def dumps(data, backend='orjson', indent=False):
+    """Encodes data to JSON bytes."""
+    if backend == 'orjson' and orjson is not None:
+        # non string dict keys (ints) are converted like json.dumps does
+        option = orjson.OPT_NON_STR_KEYS | (orjson.OPT_INDENT_2 if indent else 0)
+        return orjson.dumps(data, default=json_default, option=option)
+    return json.dumps(data, default=json_default, indent=2 if indent else None).encode()
+
+
+def output_json(data, code, headers=None):
+    """Same as flask_restx's output_json (indented in debug mode, ends in a newline), with a faster encoder."""
+    backend = current_app.config.get('JSON_BACKEND', 'orjson')
+    resp = make_response(dumps(data, backend, indent=current_app.debug) + b'\n', code)
+    resp.headers.extend(headers or {})
+    return resp
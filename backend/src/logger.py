@@ -4,6 +4,8 @@ from logging.config import dictConfig
 def init_logger():
     dictConfig({
         'version': 1,
+        # keep loggers created before this runs (the app's 'myapp' logger, gunicorn's)
+        'disable_existing_loggers': False,
         'formatters': {'default': {
             'format': '[%(asctime)s] %(levelname)s in %(module)s: %(message)s',
         }},
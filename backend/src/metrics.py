@@ -0,0 +1,108 @@
+import os
+import re
+import time
+from contextlib import contextmanager
+from urllib.parse import urlparse
+from flask import request, g, Response
+from prometheus_client import Counter, Histogram, CollectorRegistry, REGISTRY, generate_latest, CONTENT_TYPE_LATEST
+from prometheus_client import multiprocess
+
+# Prometheus metrics, served as text from /metrics.
+# Under gunicorn every worker writes its samples to PROMETHEUS_MULTIPROC_DIR (set in gunicorn.conf.py) and
+# /metrics aggregates all of them, so a scrape sees the whole container whichever worker answers it.
+
+# Spotify/Gemini calls take 50ms to a few seconds, a whole /create_recs up to a minute
+LATENCY_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+CREATE_RECS_STAGE_SECONDS = Histogram(
+    'create_recs_stage_seconds',
+    'Time spent in each stage of the /create_recs pipeline',
+    ['stage'],
+    buckets=LATENCY_BUCKETS
+)
+OUTBOUND_REQUESTS = Counter(
+    'outbound_requests_total',
+    'Requests sent to Spotify and Gemini, by response status',
+    ['service', 'endpoint', 'status']
+)
+OUTBOUND_REQUEST_SECONDS = Histogram(
+    'outbound_request_seconds',
+    'Latency of requests sent to Spotify and Gemini',
+    ['service', 'endpoint'],
+    buckets=LATENCY_BUCKETS
+)
+HTTP_REQUEST_SECONDS = Histogram(
+    'http_request_seconds',
+    'Latency of requests served by the API',
+    ['method', 'route', 'status'],
+    buckets=LATENCY_BUCKETS
+)
+
+# Spotify ids in request paths, replaced so every playlist / user / track shares one endpoint label
+SPOTIFY_ID_PATHS = [
+    (re.compile(r'^/users/[^/]+/playlists$'), '/users/{id}/playlists'),
+    (re.compile(r'^/playlists/[^/]+/tracks$'), '/playlists/{id}/tracks'),
+    (re.compile(r'^/tracks/[^/]+$'), '/tracks/{id}')
+]
+
+
+def spotify_endpoint(url):
+    path = urlparse(url).path
+    path = path[len('/v1'):] if path.startswith('/v1/') else path
+    for pattern, template in SPOTIFY_ID_PATHS:
+        if pattern.match(path):
+            return template
+    return path
+
+
+def observe_stage(stage, seconds):
+    CREATE_RECS_STAGE_SECONDS.labels(stage=stage).observe(seconds)
+
+
+@contextmanager
+def stage_timer(stage, timings=None):
+    """Times a block as a /create_recs stage; also stores the duration in timings[stage] when given a dict."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        observe_stage(stage, elapsed)
+        if timings is not None:
+            timings[stage] = round(elapsed, 4)
+
+
+def observe_outbound(service, endpoint, status, seconds):
+    OUTBOUND_REQUESTS.labels(service=service, endpoint=endpoint, status=str(status)).inc()
+    OUTBOUND_REQUEST_SECONDS.labels(service=service, endpoint=endpoint).observe(seconds)
+
+
+def init_metrics(app):
+    """Times every request the app serves (labelled with the route pattern, not the raw path)."""
+
+    @app.before_request
+    def start_timer():
+        g.request_started = time.perf_counter()
+
+    @app.after_request
+    def record_request(response):
+        started = g.pop('request_started', None)
+        if started is not None:
+            route = request.url_rule.rule if request.url_rule else 'unmatched'
+            HTTP_REQUEST_SECONDS.labels(
+                method=request.method, route=route, status=str(response.status_code)
+            ).observe(time.perf_counter() - started)
+        return response
+
+
+def metrics_registry():
+    if os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+        # a fresh registry reading every worker's files on each scrape, as prometheus_client documents
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return registry
+    return REGISTRY
+
+
+def metrics_response():
+    return Response(generate_latest(metrics_registry()), mimetype=CONTENT_TYPE_LATEST)
@@ -0,0 +1,160 @@
+import argparse
+import json
+import os
+import re
+import sys
+from sqlalchemy import create_engine, text
+from src.config import Config
+
+# Versioned SQL migrations for an existing database, next to the docker init script.
+# Files in backend/migrations are named NNNN_description.sql and applied in order; applied versions are recorded
+# in schema_migrations. Run from backend/:
+#   python -m src.migrate upgrade   apply pending migrations
+#   python -m src.migrate status    list applied / pending migrations
+#   python -m src.migrate check     fail if a hot query falls back to a sequential scan
+
+MIGRATIONS_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'migrations')
+MIGRATION_FILE = re.compile(r'^(\d+)_(\w+)\.sql$')
+
+# arbitrary key for pg_advisory_xact_lock, so two containers starting at once don't both migrate
+MIGRATION_LOCK_ID = 7210345
+
+# Queries behind the history endpoints and the ON DELETE CASCADE from users. Each of them has to be
+# answerable from an index; check_query_plans() fails on any sequential scan in their plans.
+HOT_QUERIES = {
+    'prompt_history': (
+        "SELECT prompts.*, playlists.* FROM prompts "
+        "LEFT OUTER JOIN playlists ON playlists.prompt_id = prompts.id "
+        "WHERE prompts.user_id = :user_id "
+        "ORDER BY prompts.created_at DESC, prompts.id DESC LIMIT 51"
+    ),
+    'prompt_history_next_page': (
+        "SELECT prompts.*, playlists.* FROM prompts "
+        "LEFT OUTER JOIN playlists ON playlists.prompt_id = prompts.id "
+        "WHERE prompts.user_id = :user_id AND (prompts.created_at, prompts.id) < (:created_at, :id) "
+        "ORDER BY prompts.created_at DESC, prompts.id DESC LIMIT 51"
+    ),
+    'user_by_spotify_id': "SELECT * FROM users WHERE spotify_id = :spotify_id",
+    'cascade_prompts': "SELECT id FROM prompts WHERE user_id = :user_id",
+    'cascade_playlists': "SELECT id FROM playlists WHERE user_id = :user_id",
+    'cascade_rec_jobs': "SELECT id FROM rec_jobs WHERE user_id = :user_id",
+    'playlist_tracks': "SELECT * FROM playlist_tracks WHERE playlist_id = :id",
+    'track_cache_prune': "SELECT lookup_key FROM track_resolutions ORDER BY last_used_at DESC LIMIT 100"
+}
+
+HOT_QUERY_PARAMS = {
+    'user_id': '00000000-0000-0000-0000-000000000000',
+    'id': '00000000-0000-0000-0000-000000000000',
+    'spotify_id': 'spotify_id',
+    'created_at': '2000-01-01 00:00:00'
+}
+
+
+def load_migrations(directory=MIGRATIONS_DIR):
+    """Returns [(version, name, path)] for the migration files, in version order."""
+    migrations = []
+    for filename in os.listdir(directory):
+        match = MIGRATION_FILE.match(filename)
+        if match:
+            migrations.append((match.group(1), match.group(2), os.path.join(directory, filename)))
+    return sorted(migrations, key=lambda migration: int(migration[0]))
+
+
+def ensure_migrations_table(conn):
+    conn.execute(text(
+        "CREATE TABLE IF NOT EXISTS schema_migrations ("
+        "version TEXT PRIMARY KEY, name TEXT NOT NULL, applied_at TIMESTAMP NOT NULL DEFAULT NOW())"
+    ))
+
+
+def applied_versions(conn):
+    return {row.version for row in conn.execute(text("SELECT version FROM schema_migrations"))}
+
+
+def upgrade(engine, directory=MIGRATIONS_DIR):
+    """
+    Applies the pending migrations and returns their versions.
+    Everything runs in one transaction (Postgres DDL is transactional), so a failing migration leaves the
+    database as it was.
+    """
+    with engine.begin() as conn:
+        conn.execute(text("SELECT pg_advisory_xact_lock(:lock_id)"), {'lock_id': MIGRATION_LOCK_ID})
+        ensure_migrations_table(conn)
+        applied = applied_versions(conn)
+
+        pending = [migration for migration in load_migrations(directory) if migration[0] not in applied]
+        for version, name, path in pending:
+            with open(path) as f:
+                conn.exec_driver_sql(f.read())
+            conn.execute(
+                text("INSERT INTO schema_migrations (version, name) VALUES (:version, :name)"),
+                {'version': version, 'name': name}
+            )
+    return [version for version, _, _ in pending]
+
+
+def status(engine, directory=MIGRATIONS_DIR):
+    """Returns [(version, name, applied)] for every migration file."""
+    with engine.begin() as conn:
+        ensure_migrations_table(conn)
+        applied = applied_versions(conn)
+    return [(version, name, version in applied) for version, name, _ in load_migrations(directory)]
+
+
+def seq_scans(plan):
+    # walks an EXPLAIN (FORMAT JSON) plan tree, yields the relations read with a sequential scan
+    if plan.get('Node Type') == 'Seq Scan':
+        yield plan.get('Relation Name')
+    for child in plan.get('Plans', []):
+        yield from seq_scans(child)
+
+
+def check_query_plans(engine, queries=HOT_QUERIES):
+    """
+    EXPLAINs every hot query with enable_seqscan off and returns {query name: [tables]} for the queries that
+    still plan a sequential scan, i.e. have no usable index. With seqscans disabled the check doesn't depend on
+    table size: an empty development database gives the same answer as production.
+    """
+    failures = {}
+    with engine.connect() as conn:
+        with conn.begin() as transaction:
+            conn.execute(text("SET LOCAL enable_seqscan = off"))
+            for name, query in queries.items():
+                explained = conn.execute(text(f"EXPLAIN (FORMAT JSON) {query}"), HOT_QUERY_PARAMS).scalar()
+                if isinstance(explained, str):
+                    explained = json.loads(explained)
+                tables = list(seq_scans(explained[0]['Plan']))
+                if tables:
+                    failures[name] = tables
+            transaction.rollback()
+    return failures
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Database migrations')
+    parser.add_argument('command', choices=['upgrade', 'status', 'check'])
+    parser.add_argument('--database-url', default=Config.SQLALCHEMY_DATABASE_URI)
+    args = parser.parse_args(argv)
+
+    if not args.database_url:
+        parser.error('DATABASE_URL is not set')
+    engine = create_engine(args.database_url)
+
+    if args.command == 'upgrade':
+        applied = upgrade(engine)
+        print(f"Applied {', '.join(applied)}" if applied else 'Database is up to date')
+    elif args.command == 'status':
+        for version, name, applied in status(engine):
+            print(f"{version} {name}: {'applied' if applied else 'pending'}")
+    else:
+        failures = check_query_plans(engine)
+        for name, tables in failures.items():
+            print(f"{name}: sequential scan on {', '.join(tables)}")
+        if failures:
+            return 1
+        print(f'All {len(HOT_QUERIES)} hot queries use indexes')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -24,6 +24,11 @@ class Prompt(db.Model):
 
     playlist = db.relationship('Playlist', backref='prompt', uselist=False, cascade="all, delete-orphan")
 
+    __table_args__ = (
+        # prompt history is read per user, newest first (see migrations/0002_history_indexes.sql)
+        db.Index('prompts_user_id_created_at_idx', 'user_id', 'created_at', 'id'),
+    )
+
 class Playlist(db.Model):
     __tablename__ = 'playlists'
 
@@ -36,10 +41,47 @@ class Playlist(db.Model):
 
     tracks = db.relationship('PlaylistTrack', backref='playlist', cascade="all, delete-orphan")
 
+    __table_args__ = (
+        db.Index('playlists_user_id_idx', 'user_id'),
+    )
+
 class PlaylistTrack(db.Model):
     __tablename__ = 'playlist_tracks'
 
     playlist_id = db.Column(db.String, db.ForeignKey('playlists.id', ondelete='CASCADE'), primary_key=True)
     spotify_track_id = db.Column(db.String, primary_key=True)
     track_name = db.Column(db.String, nullable=False)
-    artist_name = db.Column(db.String, nullable=False)
\ No newline at end of file
+    artist_name = db.Column(db.String, nullable=False)
+
+class TrackResolution(db.Model):
+    __tablename__ = 'track_resolutions'
+
+    # normalized "track<sep>artist" pair, rows with no spotify_uri are cached misses
+    lookup_key = db.Column(db.String, primary_key=True)
+    spotify_track_id = db.Column(db.String)
+    spotify_uri = db.Column(db.String)
+    resolved_at = db.Column(db.DateTime, server_default=db.func.now())
+    last_used_at = db.Column(db.DateTime, server_default=db.func.now())
+
+    __table_args__ = (
+        db.Index('track_resolutions_last_used_at_idx', 'last_used_at'),
+    )
+
+class RecJob(db.Model):
+    __tablename__ = 'rec_jobs'
+
+    # background /create_recs run; status is queued -> running -> succeeded / failed
+    id = db.Column(db.String, primary_key=True, default=db.text('gen_random_uuid()'))
+    user_id = db.Column(db.String, db.ForeignKey('users.id', ondelete='CASCADE'), nullable=False)
+    prompt = db.Column(db.String, nullable=False)
+    status = db.Column(db.String, nullable=False, server_default='queued')
+    stage = db.Column(db.String)
+    stages = db.Column(db.JSON, nullable=False, server_default='[]')
+    result = db.Column(db.JSON)
+    status_code = db.Column(db.Integer)
+    created_at = db.Column(db.DateTime, server_default=db.func.now())
+    updated_at = db.Column(db.DateTime, server_default=db.func.now())
+
+    __table_args__ = (
+        db.Index('rec_jobs_user_id_idx', 'user_id'),
+    )
@@ -0,0 +1,149 @@
+import cProfile
+import hmac
+import json
+import os
+import random
+import sys
+import threading
+import time
+import uuid
+from flask import request, g
+from src.logger import logger
+
+# Opt-in per-request profiler.
+# A request is profiled when it sends X-Profile-Token matching PROFILE_TOKEN, or is picked by PROFILE_SAMPLE_RATE.
+# Two files are written to PROFILE_DIR for it:
+#   <id>.pstats           CPU time of the request thread per function (cProfile with a thread CPU clock),
+#                         open with python -m pstats or snakeviz
+#   <id>.speedscope.json  wall-clock stack samples of the request thread, so time blocked on Spotify, Gemini
+#                         or Postgres shows up too; open in https://www.speedscope.app
+# The response carries X-Profile-Id: <id>. With neither setting on, no hooks are registered at all.
+#
+# Only the request thread is profiled: work handed to the search pool shows up as time waiting on its futures.
+
+PROFILE_HEADER = 'X-Profile-Token'
+
+# one profiled request at a time per process: cProfile can't run in two threads at once on newer Pythons,
+# and it keeps the overhead bounded if the sampling rate is set too high
+_profile_lock = threading.Lock()
+
+
+class WallClockSampler:
+    """Samples one thread's stack every interval seconds from a background thread."""
+
+    def __init__(self, thread_id, interval=0.005):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.frames = {}  # (name, file, line) -> index
+        self.samples = []
+        self.weights = []
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='profile-sampler', daemon=True)
+
+    def start(self):
+        self.started = time.perf_counter()
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        self.elapsed = time.perf_counter() - self.started
+
+    def _run(self):
+        last = time.perf_counter()
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            now = time.perf_counter()
+            if frame is None:
+                continue
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                key = (code.co_name, code.co_filename, code.co_firstlineno)
+                stack.append(self.frames.setdefault(key, len(self.frames)))
+                frame = frame.f_back
+            stack.reverse()  # speedscope wants root first
+            self.samples.append(stack)
+            self.weights.append(now - last)
+            last = now
+
+    def to_speedscope(self, name):
+        return {
+            '$schema': 'https://www.speedscope.app/file-format-schema.json',
+            'name': name,
+            'exporter': 'src.profiler',
+            'shared': {'frames': [
+                {'name': frame_name, 'file': filename, 'line': line}
+                for frame_name, filename, line in self.frames
+            ]},
+            'profiles': [{
+                'type': 'sampled',
+                'name': f'{name} (wall clock)',
+                'unit': 'seconds',
+                'startValue': 0,
+                'endValue': sum(self.weights),
+                'samples': self.samples,
+                'weights': self.weights
+            }]
+        }
+
+
+def should_profile(token, sample_rate):
+    sent = request.headers.get(PROFILE_HEADER)
+    if token and sent and hmac.compare_digest(sent, token):
+        return True
+    return sample_rate > 0 and random.random() < sample_rate
+
+
+def init_profiler(app):
+    config = app.config
+    token = config.get('PROFILE_TOKEN')
+    sample_rate = config.get('PROFILE_SAMPLE_RATE', 0.0)
+    if not token and not sample_rate:
+        return
+
+    directory = config.get('PROFILE_DIR', '/tmp/profiles')
+    interval = config.get('PROFILE_WALL_INTERVAL', 0.005)
+    os.makedirs(directory, exist_ok=True)
+
+    @app.before_request
+    def start_profile():
+        if not should_profile(token, sample_rate) or not _profile_lock.acquire(blocking=False):
+            return
+        # per-thread CPU clock: other requests' threads don't count towards this one
+        profile = cProfile.Profile(time.thread_time)
+        try:
+            profile.enable()
+        except ValueError:
+            # another profiler (e.g. a debugger or coverage) already owns the hook
+            _profile_lock.release()
+            return
+        g.profile_cpu = profile
+        g.profile_sampler = WallClockSampler(threading.get_ident(), interval)
+        g.profile_sampler.start()
+        g.profile_id = f"{time.strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:8]}"
+
+    @app.after_request
+    def add_profile_header(response):
+        if 'profile_id' in g:
+            response.headers['X-Profile-Id'] = g.profile_id
+        return response
+
+    @app.teardown_request
+    def write_profile(exc):
+        profile_id = g.pop('profile_id', None)
+        if profile_id is None:
+            return
+        try:
+            g.profile_cpu.disable()
+            g.profile_sampler.stop()
+            name = f"{request.method} {request.path}"
+            base = os.path.join(directory, profile_id)
+            g.profile_cpu.dump_stats(f'{base}.pstats')
+            with open(f'{base}.speedscope.json', 'w') as f:
+                json.dump(g.profile_sampler.to_speedscope(name), f)
+            logger.info(f"Profiled {name} in {g.profile_sampler.elapsed:.3f}s: {base}.pstats, {base}.speedscope.json")
+        except Exception:
+            logger.exception(f"Could not write profile {profile_id}")
+        finally:
+            _profile_lock.release()
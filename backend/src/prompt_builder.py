@@ -0,0 +1,70 @@
+from src.gemini import prompt_template
+
+# Builds the taste data section of the Gemini prompt in a compact, token-budgeted form.
+#
+# Instead of pretty JSON, genres are listed once and referenced by number:
+#   Genres: 1 indie pop; 2 bedroom pop
+#   Clairo|1,2|78
+# and tracks are "title - artist" lines. If the prompt is still over the budget, the lowest ranked
+# entries (the end of Spotify's top lists) are dropped first.
+
+
+def estimate_tokens(text):
+    # ~4 characters per token for English text, close enough for budgeting
+    return (len(text) + 3) // 4
+
+
+def compact_line(value):
+    # keep separators out of names so every entry stays on one line
+    return ' '.join(str(value).replace('|', '/').split())
+
+
+def encode_artists(artists):
+    genre_ids = {}
+    lines = []
+    for artist in artists:
+        ids = []
+        for genre in artist.get('genres', []):
+            if genre not in genre_ids:
+                genre_ids[genre] = len(genre_ids) + 1
+            ids.append(str(genre_ids[genre]))
+        lines.append(f"{compact_line(artist['name'])}|{','.join(ids)}|{artist.get('popularity', 0)}")
+
+    genres = '; '.join(f"{genre_id} {compact_line(genre)}" for genre, genre_id in genre_ids.items())
+    return f"Genres: {genres}\nArtists (name|genre numbers|popularity):\n" + '\n'.join(lines)
+
+
+def encode_tracks(tracks):
+    lines = []
+    for track in tracks:
+        artist = track['artists'][0]['name'] if track.get('artists') else ''
+        lines.append(f"{compact_line(track['name'])} - {compact_line(artist)}")
+    return "Tracks (title - artist):\n" + '\n'.join(lines)
+
+
+def build_taste_prompt(theme, top_artists, top_tracks, token_budget=1200):
+    """
+    Encodes the user's top artists and tracks (Spotify payloads) for prompt_template within token_budget.
+    Returns (artists text, tracks text, estimated input tokens of the filled prompt).
+    """
+    artists = list(top_artists.get('items', []))
+    tracks = list(top_tracks.get('items', []))
+
+    while True:
+        artists_text = encode_artists(artists)
+        tracks_text = encode_tracks(tracks)
+        estimated_tokens = estimate_tokens(prompt_template.format(
+            theme=theme,
+            artists=artists_text,
+            tracks=tracks_text,
+            count=20,
+            part_note=''
+        ))
+        if estimated_tokens <= token_budget or (not artists and not tracks):
+            return artists_text, tracks_text, estimated_tokens
+
+        # drop the lowest ranked entry from whichever list is longer
+        if len(artists) >= len(tracks):
+            artists.pop()
+        else:
+            tracks.pop()
@@ -0,0 +1,153 @@
+import base64
+import json
+import uuid
+from datetime import datetime
+from sqlalchemy import tuple_, select, text, cast, literal_column, String
+from sqlalchemy.orm import joinedload
+from sqlalchemy.dialects.postgresql import insert
+from src.extensions import db
+from src.models import Prompt, Playlist, PlaylistTrack
+
+# Hand written queries for the hot paths, where the per-row ORM pattern costs a round trip per object
+
+
+def bulk_insert_playlist_tracks(playlist_id, tracks):
+    """
+    Adds tracks ({spotify_track_id, track_name, artist_name}) to a playlist with one multi-row
+    INSERT ... ON CONFLICT DO NOTHING, so tracks already in the playlist (or repeated in the list) are skipped.
+    Runs in the session's transaction, the caller commits. Returns the number of rows inserted.
+    """
+    rows = [{
+        'playlist_id': playlist_id,
+        'spotify_track_id': track['spotify_track_id'],
+        'track_name': track['track_name'],
+        'artist_name': track['artist_name']
+    } for track in tracks]
+    if not rows:
+        return 0
+
+    statement = insert(PlaylistTrack.__table__).values(rows).on_conflict_do_nothing(
+        index_elements=['playlist_id', 'spotify_track_id']
+    )
+    return db.session.execute(statement).rowcount
+
+
+def is_uuid(value):
+    """True if value is a uuid string, ids that aren't make postgres raise DataError instead of matching nothing."""
+    try:
+        uuid.UUID(str(value))
+    except ValueError:
+        return False
+    return True
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def encode_cursor(prompt):
+    raw = json.dumps([prompt.created_at.isoformat(), str(prompt.id)])
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+
+def decode_cursor(cursor):
+    try:
+        created_at, prompt_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        created_at = datetime.fromisoformat(created_at)
+    except (ValueError, TypeError) as e:
+        raise InvalidCursor(f'Invalid cursor: {cursor}') from e
+    if not is_uuid(prompt_id):
+        raise InvalidCursor(f'Invalid cursor: {cursor}')
+    return created_at, prompt_id
+
+
+def user_prompts_criteria(user_id, cursor=None):
+    criteria = [Prompt.user_id == user_id]
+    if cursor:
+        created_at, prompt_id = decode_cursor(cursor)
+        criteria.append(tuple_(Prompt.created_at, Prompt.id) < tuple_(created_at, prompt_id))
+    return criteria
+
+
+def get_user_prompts_page(user_id, limit, cursor=None):
+    """
+    Returns (prompts, next cursor or None) for a user's prompt history, newest first.
+    The playlist is joined in the same query, and pages are keyset paginated on (created_at, id): the cursor holds
+    the last row's values, so each page costs the same however much history comes before it.
+    """
+    prompts = (
+        Prompt.query
+        .options(joinedload(Prompt.playlist))
+        .filter(*user_prompts_criteria(user_id, cursor))
+        .order_by(Prompt.created_at.desc(), Prompt.id.desc())
+        .limit(limit + 1)
+        .all()
+    )
+
+    next_cursor = None
+    if len(prompts) > limit:
+        prompts = prompts[:limit]
+        next_cursor = encode_cursor(prompts[-1])
+    return prompts, next_cursor
+
+
+# Row version probes for ETags (see etags.py). Postgres gives every row version a new xmin, so a row's xmin
+# changes on each insert/update; comparing them is far cheaper than loading and serializing the objects.
+# They return None on other databases (no ETag then) or when the row doesn't exist.
+
+def supports_version_probes():
+    return db.engine.dialect.name == 'postgresql'
+
+
+def user_version(spotify_id):
+    if not supports_version_probes():
+        return None
+    return db.session.execute(
+        text("SELECT CAST(xmin AS text) FROM users WHERE spotify_id = :spotify_id"),
+        {'spotify_id': spotify_id}
+    ).scalar()
+
+
+def prompt_version(prompt_id):
+    if not supports_version_probes():
+        return None
+    row = db.session.execute(
+        text(
+            "SELECT CAST(prompts.xmin AS text), CAST(playlists.xmin AS text) FROM prompts "
+            "LEFT OUTER JOIN playlists ON playlists.prompt_id = prompts.id WHERE prompts.id = :prompt_id"
+        ),
+        {'prompt_id': prompt_id}
+    ).first()
+    return f"{row[0]}:{row[1]}" if row else None
+
+
+def playlist_version(playlist_id):
+    if not supports_version_probes():
+        return None
+    # the track list is folded into one hash, so added or removed tracks change the version too
+    row = db.session.execute(
+        text(
+            "SELECT CAST(playlists.xmin AS text), ("
+            "SELECT md5(string_agg(playlist_tracks.spotify_track_id || ':' || CAST(playlist_tracks.xmin AS text), "
+            "',' ORDER BY playlist_tracks.spotify_track_id)) "
+            "FROM playlist_tracks WHERE playlist_tracks.playlist_id = playlists.id"
+            ") FROM playlists WHERE playlists.id = :playlist_id"
+        ),
+        {'playlist_id': playlist_id}
+    ).first()
+    return f"{row[0]}:{row[1]}" if row else None
+
+
+def user_prompts_page_version(user_id, limit, cursor=None):
+    """Version of the page get_user_prompts_page() would return: the same index scan, reading only xmins."""
+    if not supports_version_probes():
+        return None
+    rows = db.session.execute(
+        select(cast(literal_column('prompts.xmin'), String), cast(literal_column('playlists.xmin'), String))
+        .select_from(Prompt)
+        .outerjoin(Playlist, Playlist.prompt_id == Prompt.id)
+        .where(*user_prompts_criteria(user_id, cursor))
+        .order_by(Prompt.created_at.desc(), Prompt.id.desc())
+        .limit(limit + 1)
+    ).all()
+    return ','.join(f"{prompt}:{playlist}" for prompt, playlist in rows)
@@ -0,0 +1,140 @@
+import contextvars
+import random
+import threading
+import time
+from contextlib import contextmanager
+
+# Outbound rate limiting for the Spotify Web API.
+# Spotify limits requests per app credential, so every worker thread in the process shares one token bucket
+# per credential. Interactive calls (a user waiting on the response) are served before background ones.
+
+INTERACTIVE = 0
+BACKGROUND = 1
+
+# priority of the Spotify calls made by the current thread / task, background jobs switch it with request_priority()
+_priority = contextvars.ContextVar('spotify_priority', default=INTERACTIVE)
+
+
+def current_priority():
+    return _priority.get()
+
+
+@contextmanager
+def request_priority(priority):
+    token = _priority.set(priority)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+
+class RateLimitTimeout(Exception):
+    """acquire() would have had to wait longer than its max_wait."""
+
+
+class RateLimitScheduler:
+    """
+    Token bucket refilled at `rate` requests per second, holding up to `burst` tokens (rate=0 disables the bucket).
+    acquire() blocks until the caller may send a request (raising RateLimitTimeout instead of waiting longer than
+    max_wait); while any interactive call is waiting, background calls wait too. After a 429, throttle() pauses
+    the whole bucket for Retry-After plus jittered backoff, so other threads don't keep hitting the limit.
+    """
+
+    def __init__(self, rate=20, burst=40, max_backoff=8):
+        self.rate = rate
+        self.burst = burst
+        self.max_backoff = max_backoff
+        self._tokens = burst
+        self._updated = time.monotonic()
+        self._paused_until = 0
+        self._cond = threading.Condition()
+        self._waiting = [0, 0]  # queued calls per priority
+
+        self.acquired = 0
+        self.waited = 0
+        self.wait_seconds = 0.0
+        self.throttled = 0
+        self.timeouts = 0
+
+    def _refill(self, now):
+        if self.rate:
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def acquire(self, priority=INTERACTIVE, max_wait=None):
+        start = time.monotonic()
+        with self._cond:
+            self._waiting[priority] += 1
+            try:
+                while True:
+                    now = time.monotonic()
+                    self._refill(now)
+                    behind_interactive = priority == BACKGROUND and self._waiting[INTERACTIVE] > 0
+                    has_token = not self.rate or self._tokens >= 1
+                    if now >= self._paused_until and has_token and not behind_interactive:
+                        if self.rate:
+                            self._tokens -= 1
+                        break
+
+                    wait = max(self._paused_until - now, 0)
+                    if not has_token:
+                        wait = max(wait, (1 - self._tokens) / self.rate)
+                    if max_wait is not None and now + wait - start > max_wait:
+                        self.timeouts += 1
+                        raise RateLimitTimeout(f'no Spotify rate limit token within {max_wait}s')
+                    # woken early by notify_all when an interactive call leaves the queue
+                    self._cond.wait(wait if wait > 0 else 0.05)
+            finally:
+                self._waiting[priority] -= 1
+                self._cond.notify_all()
+
+            waited = time.monotonic() - start
+            self.acquired += 1
+            if waited > 0.001:
+                self.waited += 1
+                self.wait_seconds += waited
+
+    def throttle(self, retry_after, attempt):
+        """Records a 429 and pauses the bucket, returns the delay before the next request."""
+        backoff = min(self.max_backoff, 0.25 * 2 ** attempt)
+        delay = retry_after + random.uniform(0, backoff)
+        with self._cond:
+            self.throttled += 1
+            self._paused_until = max(self._paused_until, time.monotonic() + delay)
+            self._cond.notify_all()
+        return delay
+
+    def stats(self):
+        return {
+            'rate': self.rate,
+            'burst': self.burst,
+            'queue_depth': sum(self._waiting),
+            'queue_depth_interactive': self._waiting[INTERACTIVE],
+            'queue_depth_background': self._waiting[BACKGROUND],
+            'acquired': self.acquired,
+            'waited': self.waited,
+            'wait_seconds': self.wait_seconds,
+            'throttled': self.throttled,
+            'timeouts': self.timeouts,
+            'paused_for': max(self._paused_until - time.monotonic(), 0)
+        }
+
+
+_schedulers = {}
+_schedulers_lock = threading.Lock()
+
+
+def get_scheduler(credential, rate=20, burst=40):
+    """Returns the scheduler shared by every thread using this Spotify app credential."""
+    scheduler = _schedulers.get(credential)
+    if scheduler is None:
+        with _schedulers_lock:
+            scheduler = _schedulers.get(credential)
+            if scheduler is None:
+                scheduler = RateLimitScheduler(rate=rate, burst=burst)
+                _schedulers[credential] = scheduler
+    return scheduler
+
+
+def rate_limit_stats():
+    return {credential: scheduler.stats() for credential, scheduler in list(_schedulers.items())}
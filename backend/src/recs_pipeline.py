@@ -0,0 +1,518 @@
+from flask import current_app
+from urllib.parse import quote
+from concurrent.futures import ThreadPoolExecutor
+from contextvars import copy_context
+from src.models import Prompt, Playlist
+from src.queries import bulk_insert_playlist_tracks
+from src.extensions import db
+from src.gemini import (
+    GeminiRecommendationStream,
+    BatchedRecommendationStream,
+    GeminiError,
+    parse_recommendations,
+    get_recommendation_cache
+    )
+from src.spotify_helpers import (
+    get_spotify_top_data,
+    create_spotify_playlist,
+    add_tracks_spotify_playlist,
+    get_user_id,
+    get_track_uris,
+    get_uri_from_track
+    )
+from src.spotify_client import get_spotify_client
+from src.prompt_builder import build_taste_prompt
+from src.logger import logger
+from src.track_cache import get_track_cache, normalize_track_key
+from src.metrics import stage_timer
+import requests
+import json
+import math
+import time
+
+# The /create_recs pipeline: top data -> Gemini -> Spotify search -> playlist creation -> DB writes -> track adds.
+# Used directly by the CreateRecs route and by the background job workers (src/jobs.py).
+
+# stages reported to on_stage, in order ('search' starts while Gemini is still streaming)
+STAGES = ['top_data', 'gemini', 'search', 'user_id', 'create_playlist', 'save_playlist', 'add_tracks']
+
+
+class SpotifySearchError(Exception):
+    """A track search that failed (bad status or network error), as opposed to one that found nothing."""
+
+
+def search_track(access_token, track_name, artist_name):
+    """
+    Resolves a single track/artist pair to a Spotify track.
+    Returns {uri, id} or None if nothing was found, raises SpotifySearchError if the search itself failed.
+    Runs outside the request context when called from the thread pool, so it logs through src.logger.
+    """
+    # strict search query, might need something looser for inaccurate gemini track recommendations.
+    query = f'track:"{track_name}" artist:"{artist_name}"'
+
+    #search for the track
+    spotify = get_spotify_client()
+    params = {'q': query, 'type': 'track', 'limit': 1}
+    try:
+        response = spotify.get('/search', access_token, params=params)
+    except requests.RequestException as e:
+        raise SpotifySearchError(f"Spotify search failed for {query}: {e}")
+
+    if response.status_code != 200:
+        raise SpotifySearchError(f"Spotify search failed for {query}: {response.text}")
+
+    items = response.json().get("tracks", {}).get("items", [])
+    if not items:
+        # if strict search fails, do loose search (not accurate).
+        loose_query = f"{quote(track_name)} {quote(artist_name)}"
+        params['q'] = loose_query
+        try:
+            response = spotify.get('/search', access_token, params=params)
+        except requests.RequestException as e:
+            raise SpotifySearchError(f"Spotify search failed for {loose_query}: {e}")
+        if response.status_code != 200:
+            raise SpotifySearchError(f"Spotify search failed for {loose_query}: {response.text}")
+        items = response.json().get("tracks", {}).get("items", [])
+        if not items:
+            return None
+
+    # search results already carry the uri; if it's missing the caller batches a /v1/tracks lookup by id
+    return {"uri": get_uri_from_track(items[0]), "id": items[0]["id"]}
+
+
+def search_pair(access_token, track_name, artist_name):
+    """Runs search_track on a worker thread, returns (track or None, whether the search failed)."""
+    try:
+        return search_track(access_token, track_name, artist_name), False
+    except SpotifySearchError as e:
+        logger.error(str(e))
+        return None, True
+
+
+def fill_missing_uris(access_token, resolved, failed):
+    """Fills in uris the search payloads didn't include with batched /v1/tracks calls."""
+    missing = [key for key, track in resolved.items() if track and not track['uri']]
+    if not missing:
+        return
+    uris, uri_error = get_track_uris(access_token, [resolved[key]['id'] for key in missing])[:2]
+    if uri_error:
+        logger.error(f"Error getting URIs for tracks: {uri_error}")
+        uris = [None] * len(missing)
+    for key, uri in zip(missing, uris):
+        if uri:
+            resolved[key]['uri'] = uri
+        else:
+            resolved[key] = None
+            failed.add(key)
+
+
+def resolve_recommendations(access_token, recommendations, max_workers=None):
+    """
+    Looks up every recommendation on Spotify, a track/artist pair that appears more than once is searched once.
+    recommendations can be any iterable, e.g. a GeminiRecommendationStream: each one is looked up as soon as it
+    arrives, so searching overlaps with generation. Pairs already in the resolution cache (TRACK_CACHE_BACKEND) skip
+    the search, the rest run on a bounded thread pool (SPOTIFY_SEARCH_CONCURRENCY, 1 resolves them one at a time).
+    Returns (recs, their keys (None for invalid ones), key -> {uri, id} or None), for track_lists.
+    """
+    if max_workers is None:
+        max_workers = current_app.config.get('SPOTIFY_SEARCH_CONCURRENCY', 8)
+
+    # cache lookups and writes happen here, in the request context, so the postgres backend can use the db
+    track_cache = get_track_cache()
+
+    recs = []
+    keys = []
+    resolved = {}
+    futures = {}
+    pending = {}  # key -> (track, artist) waiting for a batched cache lookup
+    pending_since = None
+    # a shared backend (postgres) costs a round trip per get_many, so its lookups are batched; memory is per key.
+    # A batch is looked up once it's full or its oldest key has waited TRACK_CACHE_LOOKUP_WAIT seconds, so searches
+    # still start while Gemini is streaming
+    batched = track_cache is not None and track_cache.batch_lookups
+    lookup_batch = current_app.config.get('TRACK_CACHE_LOOKUP_BATCH', 25) if batched else 1
+    lookup_wait = current_app.config.get('TRACK_CACHE_LOOKUP_WAIT', 0.05)
+
+    with ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+        def submit_search(key, track_name, artist_name):
+            # copy_context keeps the caller's request priority (see rate_limiter) on the worker thread
+            futures[key] = executor.submit(copy_context().run, search_pair, access_token, track_name, artist_name)
+
+        def flush_lookups():
+            cached = track_cache.get_many(list(pending)) if track_cache else {}
+            for key, (track_name, artist_name) in pending.items():
+                if key in cached:
+                    resolved[key] = cached[key]
+                else:
+                    submit_search(key, track_name, artist_name)
+            pending.clear()
+
+        for rec in recommendations:
+            recs.append(rec)
+            track_name = rec.get('track')
+            artist_name = rec.get('artist')
+            if not track_name or not artist_name:
+                logger.warning(f"Skipping invalid recommendation: {rec}")
+                keys.append(None)
+                continue
+            key = normalize_track_key(track_name, artist_name)
+            keys.append(key)
+            if key in resolved or key in futures or key in pending:
+                continue
+
+            if not pending:
+                pending_since = time.monotonic()
+            pending[key] = (track_name, artist_name)
+            if len(pending) >= lookup_batch or time.monotonic() - pending_since >= lookup_wait:
+                flush_lookups()
+        if pending:
+            flush_lookups()
+
+    searched = {}
+    failed = set()
+    for key, future in futures.items():
+        searched[key], search_failed = future.result()
+        if search_failed:
+            failed.add(key)
+    fill_missing_uris(access_token, searched, failed)
+    resolved.update(searched)
+    if track_cache and searched:
+        # failed searches aren't cached, so they're retried next time instead of sticking as misses
+        track_cache.set_many({key: track for key, track in searched.items() if key not in failed})
+    return recs, keys, resolved
+
+
+def track_lists(recs, keys, resolved, order=None):
+    """
+    Splits resolved recommendations into (track URIs, tracks, not found recs). Results keep the order of the
+    recommendations, or are sorted by order(rec) when given (see BatchedRecommendationStream.position).
+    """
+    results = list(zip(recs, keys))
+    if order:
+        results.sort(key=lambda result: order(result[0]))
+
+    track_uris = []
+    not_found = []
+    tracks = []
+    for rec, key in results:
+        track = resolved.get(key) if key else None
+        if track:
+            track_uris.append(track['uri'])
+            tracks.append({"uri": track['uri'], "name": rec['track'], "artist": rec['artist']})
+        else:
+            not_found.append(rec)  #add to not found, and continue
+    return track_uris, tracks, not_found
+
+
+def get_track_uris_from_spotify(access_token, recommendations, max_workers=None, order=None):
+    """
+    Searches for track URIs on Spotify and returns a list of URIs and a list of not found tracks.
+    See resolve_recommendations and track_lists.
+    """
+    recs, keys, resolved = resolve_recommendations(access_token, recommendations, max_workers)
+    return track_lists(recs, keys, resolved, order)
+
+
+def recommendation_key(rec):
+    """Dedupe key of a recommendation, None for one without a track or artist (the resolver skips those)."""
+    if not rec.get('track') or not rec.get('artist'):
+        return None
+    return normalize_track_key(rec['track'], rec['artist'])
+
+
+def recommendation_stream(prompt, top_artists_text, top_tracks_text, playlist_size, cache=None):
+    """
+    The Gemini stream for a playlist of playlist_size songs. Up to GEMINI_BATCH_SIZE songs come from one
+    generation; larger playlists are split into parts of about that size, generated at the same time
+    (GEMINI_BATCH_CONCURRENCY), so a 300-song playlist takes about as long to generate as a 50-song one.
+    """
+    config = current_app.config
+    batch_size = config.get('GEMINI_BATCH_SIZE', 50)
+    if playlist_size <= batch_size:
+        return GeminiRecommendationStream(prompt, top_artists_text, top_tracks_text, cache=cache, count=playlist_size)
+
+    # parts are generated independently and can pick the same song, ask for ~10% more than needed
+    requested = playlist_size + math.ceil(playlist_size * 0.1)
+    parts = math.ceil(requested / batch_size)
+    count = math.ceil(requested / parts)
+    streams = [
+        GeminiRecommendationStream(prompt, top_artists_text, top_tracks_text, cache=cache,
+                                   count=count, part=part, parts=parts, total=playlist_size)
+        for part in range(1, parts + 1)
+    ]
+    return BatchedRecommendationStream(
+        streams,
+        key=recommendation_key,
+        max_workers=config.get('GEMINI_BATCH_CONCURRENCY', 6)
+    )
+
+
+def playlist_details(prompt):
+    """(name, description) of the Spotify playlist made for a prompt."""
+    return f"{prompt} Vibes", f"Playlist generated from your prompt: {prompt}"
+
+
+def save_playlist(user, prompt_id, spotify_playlist_id, playlist_name, tracks):
+    """Adds the playlist and its tracks to the session (flushed, not committed)."""
+    new_playlist = Playlist(
+        user_id=user.id,
+        prompt_id=prompt_id,
+        spotify_playlist_id=spotify_playlist_id,
+        playlist_name=playlist_name
+    )
+    db.session.add(new_playlist)
+    db.session.flush()
+
+    # add tracks to database, one multi-row insert (a track gemini repeated is only stored once)
+    bulk_insert_playlist_tracks(new_playlist.id, [{
+        'spotify_track_id': track['uri'],
+        'track_name': track['name'],
+        'artist_name': track['artist']
+    } for track in tracks])
+    return new_playlist
+
+
+def run_create_recs(user, prompt, access_token, on_stage=None, use_cache=True, playlist_size=None):
+    """
+    Runs the whole recommendation pipeline for a user and a prompt.
+    on_stage(stage) is called as each of STAGES starts, use_cache=False bypasses the Gemini recommendation cache.
+    playlist_size is the number of songs to generate (PLAYLIST_SIZE_DEFAULT when None).
+    Returns (response body, status code), the same responses CreateRecs sends.
+    """
+    if playlist_size is None:
+        playlist_size = current_app.config.get('PLAYLIST_SIZE_DEFAULT', 20)
+
+    def stage(name):
+        if on_stage:
+            on_stage(name)
+
+    track_uris = []
+    timings = {}  # seconds per stage, exported to /metrics and logged once at the end
+
+    # Create prompt in database
+    new_prompt = Prompt(
+        user_id=user.id,
+        mood=prompt,
+        additional_notes=None
+    )
+    db.session.add(new_prompt)
+    db.session.flush()
+    prompt_id = new_prompt.id
+
+    # Get Spotify user data (top tracks and top artists) JOSHUA
+    stage('top_data')
+    with stage_timer('top_data', timings):
+        top_data, error = get_spotify_top_data(access_token)
+    print(f"TOP DATA: {top_data}")
+    if error:
+        return error, 500
+    if top_data:
+        top_tracks = top_data['top_tracks']
+        top_artists = top_data['top_artists']
+    
+    # Send user data (JSON should incl genre for artists) and prompt to Gemini (should return seed_tracks, seed_artists, and seed_genres) AALEIA
+    stage('gemini')
+    with stage_timer('prompt_build', timings):
+        top_artists_text, top_tracks_text, prompt_tokens = build_taste_prompt(
+            prompt, top_artists, top_tracks, current_app.config.get('GEMINI_PROMPT_TOKEN_BUDGET', 1200)
+        )
+    current_app.logger.info(f"Gemini prompt: ~{prompt_tokens} input tokens")
+
+    # 1. stream the recommendations from Gemini, each {track, artist} is handed to the Spotify search as soon as
+    # it's complete, so the searches (4.) run while the rest of the list is still being generated
+    stream = recommendation_stream(prompt, top_artists_text, top_tracks_text, playlist_size,
+                                   cache=get_recommendation_cache() if use_cache else None)
+    order = getattr(stream, 'position', None)
+    stage('search')
+    try:
+        # includes waiting on the Gemini stream, the gemini_* stages time the generation itself
+        with stage_timer('search', timings):
+            track_uris, tracks, not_found = get_track_uris_from_spotify(access_token, stream, order=order)  #combine track search
+    except GeminiError as e:
+        return {'error': str(e)}, 500
+    # batched generations ask for a few extra songs to cover duplicates between parts
+    track_uris, tracks = track_uris[:playlist_size], tracks[:playlist_size]
+    for name, seconds in (('gemini_first_token', stream.first_token_seconds), ('gemini_complete', stream.completion_seconds)):
+        timings[name] = round(seconds, 4) if seconds is not None else None
+    full_text = stream.raw_text
+    recommendations = stream.recommendations
+
+    current_app.logger.info(f"Gemini JSON Response: {full_text}")
+
+    # 2. nothing parsed from the stream: fall back to parsing the full text, to report what went wrong
+    if not recommendations:
+        try:
+            recommendations = parse_recommendations(full_text)
+        except json.JSONDecodeError as e:
+            current_app.logger.error(f"JSONDecodeError: {e} - Raw response: {full_text}")
+            return {'error': 'Invalid JSON from Gemini', 'raw': full_text}, 500
+
+        if not recommendations:
+            return {'error': 'No songs extracted from Gemini response', 'raw': full_text}, 500
+        track_uris, tracks, not_found = get_track_uris_from_spotify(access_token, recommendations)
+    current_app.logger.info(f"Extracted recommendations: {recommendations}")
+    current_app.logger.info(f"Tracks: {tracks}")
+    if not track_uris and not not_found:
+        return {'error': 'No tracks found on Spotify', 'recommendations': recommendations}, 500
+
+    # 5. get user ID from Spotify
+    stage('user_id')
+    with stage_timer('user_id', timings):
+        user_id, error = get_user_id(access_token)[:2]
+    if error:
+        return {'error': 'Could not get user ID', 'details': error}, 500
+
+    # 6. create playlist
+    stage('create_playlist')
+    playlist_name, playlist_description = playlist_details(prompt)
+    with stage_timer('create_playlist', timings):
+        playlist_data, error = create_spotify_playlist(access_token, user_id, playlist_name, playlist_description)[:2]
+    if error:
+        return {'error': 'Failed to create Spotify playlist', 'details': error}, 500
+
+    playlist_id = playlist_data['id']
+
+    # 7 create playlist in database
+    stage('save_playlist')
+    with stage_timer('db_write', timings):
+        save_playlist(user, prompt_id, playlist_id, playlist_name, tracks)
+        db.session.commit()
+
+    # 8. add tracks to the playlist
+    stage('add_tracks')
+    with stage_timer('add_tracks', timings):
+        error = add_tracks_spotify_playlist(access_token, playlist_id, track_uris)[1]
+    if error:
+        return {'error': 'Failed to add tracks to playlist', 'details': error}, 500
+
+    current_app.logger.info(f"create_recs stage timings: {json.dumps(timings)}")
+    return {
+        'message': 'Playlist created successfully!',
+        'playlist_id': playlist_id,
+        'playlist_name': playlist_name,
+        'track_count': len(track_uris),
+        'not_found': not_found,
+        'recommendations': recommendations,  # inc the parsed recommendations
+        'recommendations_cached': stream.cached,
+        'prompt_tokens_estimate': prompt_tokens
+    }, 201
+
+
+def run_create_recs_batch(user, prompts, access_token, use_cache=True, playlist_size=None):
+    """
+    Creates a playlist for each of several prompts, sharing what separate /create_recs calls would each repeat:
+    the top data and Spotify user id are fetched once, the Gemini generations run at the same time
+    (GEMINI_BATCH_CONCURRENCY) and a song recommended for more than one playlist is searched only once.
+    Returns (response body, status code): 201 with a result per prompt, in order (a playlist, or the error for a
+    prompt whose generation failed or found nothing), 500 when no playlist could be made.
+    """
+    config = current_app.config
+    if playlist_size is None:
+        playlist_size = config.get('PLAYLIST_SIZE_DEFAULT', 20)
+    timings = {}
+
+    with stage_timer('batch_top_data', timings):
+        top_data, error = get_spotify_top_data(access_token)
+    if error:
+        return error, 500
+    top_tracks = top_data['top_tracks']
+    top_artists = top_data['top_artists']
+
+    with stage_timer('batch_prompt_build', timings):
+        taste_prompts = [
+            build_taste_prompt(prompt, top_artists, top_tracks, config.get('GEMINI_PROMPT_TOKEN_BUDGET', 1200))
+            for prompt in prompts
+        ]
+
+    # one stream per prompt, all generated at once and searched as they arrive through a single resolver
+    cache = get_recommendation_cache() if use_cache else None
+    streams = [
+        recommendation_stream(prompt, artists_text, tracks_text, playlist_size, cache=cache)
+        for prompt, (artists_text, tracks_text, _) in zip(prompts, taste_prompts)
+    ]
+    batch = BatchedRecommendationStream(streams, max_workers=config.get('GEMINI_BATCH_CONCURRENCY', 6))
+    try:
+        with stage_timer('batch_search', timings):
+            recs, keys, resolved = resolve_recommendations(access_token, batch)
+    except GeminiError as e:
+        return {'error': str(e)}, 500
+    rec_keys = {id(rec): key for rec, key in zip(recs, keys)}
+
+    with stage_timer('batch_user_id', timings):
+        user_id, error = get_user_id(access_token)[:2]
+    if error:
+        return {'error': 'Could not get user ID', 'details': error}, 500
+
+    results = [None] * len(prompts)
+    playlists = []  # index, prompt, stream, track uris, tracks, not found
+    for index, (prompt, stream) in enumerate(zip(prompts, streams)):
+        if index in batch.failed:
+            results[index] = {'prompt': prompt, 'error': str(batch.failed[index])}
+            continue
+        stream_recs = stream.recommendations
+        track_uris, tracks, not_found = track_lists(stream_recs, [rec_keys[id(rec)] for rec in stream_recs], resolved)
+        if not track_uris:
+            results[index] = {'prompt': prompt, 'error': 'No tracks found on Spotify', 'recommendations': stream_recs}
+            continue
+        playlists.append((index, prompt, stream, track_uris[:playlist_size], tracks[:playlist_size], not_found))
+
+    workers = max(1, min(len(playlists), config.get('CREATE_RECS_BATCH_CONCURRENCY', 4)))
+    with stage_timer('batch_create_playlist', timings), ThreadPoolExecutor(max_workers=workers) as executor:
+        # copy_context() runs here, so the workers get the caller's request priority (see rate_limiter)
+        futures = [
+            executor.submit(copy_context().run, create_spotify_playlist, access_token, user_id,
+                            *playlist_details(playlist[1]))
+            for playlist in playlists
+        ]
+        created = [future.result() for future in futures]
+
+    saved = []
+    with stage_timer('batch_db_write', timings):
+        for (index, prompt, stream, track_uris, tracks, not_found), result in zip(playlists, created):
+            playlist_data, error = result[:2]
+            if error:
+                results[index] = {'prompt': prompt, 'error': 'Failed to create Spotify playlist', 'details': error}
+                continue
+            new_prompt = Prompt(user_id=user.id, mood=prompt, additional_notes=None)
+            db.session.add(new_prompt)
+            db.session.flush()
+            playlist_name = playlist_details(prompt)[0]
+            save_playlist(user, new_prompt.id, playlist_data['id'], playlist_name, tracks)
+            saved.append((index, prompt, stream, playlist_data['id'], playlist_name, track_uris, not_found))
+        db.session.commit()
+
+    with stage_timer('batch_add_tracks', timings), ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = [
+            executor.submit(copy_context().run, add_tracks_spotify_playlist, access_token, playlist[3], playlist[5])
+            for playlist in saved
+        ]
+        added = [future.result() for future in futures]
+
+    for (index, prompt, stream, playlist_id, playlist_name, track_uris, not_found), result in zip(saved, added):
+        error = result[1]
+        if error:
+            results[index] = {'prompt': prompt, 'error': 'Failed to add tracks to playlist', 'details': error}
+            continue
+        results[index] = {
+            'prompt': prompt,
+            'playlist_id': playlist_id,
+            'playlist_name': playlist_name,
+            'track_count': len(track_uris),
+            'not_found': not_found,
+            'recommendations': stream.recommendations,
+            'recommendations_cached': stream.cached,
+            'prompt_tokens_estimate': taste_prompts[index][2]
+        }
+
+    created_count = sum(1 for result in results if 'playlist_id' in result)
+    current_app.logger.info(
+        f"create_recs batch of {len(prompts)}: {created_count} created, {len(resolved)} distinct tracks resolved, "
+        f"stage timings: {json.dumps(timings)}"
+    )
+    body = {
+        'message': f'{created_count} of {len(prompts)} playlists created',
+        'created': created_count,
+        'failed': len(prompts) - created_count,
+        'playlists': results
+    }
+    return body, 201 if created_count else 500
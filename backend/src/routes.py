@@ -1,27 +1,40 @@
 from flask import jsonify, request, session, current_app
 from flask_restx import Api, Resource, fields
-from src.models import User, Prompt, Playlist, PlaylistTrack
+from sqlalchemy.exc import IntegrityError, DataError
+from sqlalchemy.orm import joinedload
+from src.models import User, Prompt, Playlist, PlaylistTrack, RecJob
 from src.extensions import db
 from dotenv import load_dotenv
-from src.gemini import get_gemini_recommendation
 from src.spotify_helpers import (
-    get_spotify_top_data, 
     get_spotify_ids_for_tracks, 
     get_spotify_ids_for_artists,
     create_spotify_playlist,
     add_tracks_spotify_playlist,
     get_user_id,
-    get_track_uri,
+    get_track_uris,
+    get_uri_from_track,
     get_spotify_saved_tracks
     )
 from src.spotify_api import init_spotify_api
-import json
-import re
+from src.recs_pipeline import run_create_recs, run_create_recs_batch
+from src.jobs import submit_create_recs_job, serialize_job, expire_stale_job
+from src.queries import (
+    bulk_insert_playlist_tracks, get_user_prompts_page, InvalidCursor, is_uuid,
+    user_version, prompt_version, playlist_version, user_prompts_page_version
+)
+from src.etags import check_etag, etag_headers
+from src.json_output import output_json
+from src.serializers import serialize_prompt
+from src.cache import cache_stats
+from src.rate_limiter import rate_limit_stats
+from src.db_pool import pool_stats
+from src.metrics import metrics_response
 
 
 def init_routes(app):
 
     api = Api(app, title="API", description="API documentation")
+    api.representation('application/json')(output_json)
 
     # include Spotify Web API routes
     api = init_spotify_api(api)
@@ -54,9 +67,23 @@ def init_routes(app):
         'artist_name': fields.String(required=True, description='Name of the artist')
     })
 
+    playlist_tracks_model = api.model('PlaylistTracks', {
+        'tracks': fields.List(fields.Nested(playlist_track_model), required=True, description='Tracks to add')
+    })
+
     recommendation_model = api.model('Recommendations', {
         'prompt': fields.String(required=True, description='Prompt'),
         'spotify_id': fields.String(required=True, description='Spotify ID of the user'),
+        'async': fields.Boolean(description='Run as a background job, responds 202 with a job ID to poll'),
+        'no_cache': fields.Boolean(description='Always generate new recommendations instead of using the cache'),
+        'playlist_size': fields.Integer(description='Number of songs to generate, 20 by default (up to PLAYLIST_SIZE_MAX)'),
+    })
+
+    recommendation_batch_model = api.model('RecommendationBatch', {
+        'prompts': fields.List(fields.String, required=True, description='One prompt per playlist'),
+        'spotify_id': fields.String(required=True, description='Spotify ID of the user'),
+        'no_cache': fields.Boolean(description='Always generate new recommendations instead of using the cache'),
+        'playlist_size': fields.Integer(description='Number of songs per playlist, 20 by default (up to PLAYLIST_SIZE_MAX)'),
     })
 
     # User routes
@@ -64,8 +91,13 @@ def init_routes(app):
     class GetUser(Resource):
         @api.doc(description="Get a user by their Spotify ID.")
         @api.response(200, 'User found')
+        @api.response(304, 'Not modified')
         @api.response(404, 'User not found')
         def get(self, spotify_id):
+            etag, not_modified = check_etag(user_version(spotify_id), 'user', spotify_id)
+            if not_modified:
+                return not_modified
+
             user = User.query.filter_by(spotify_id=spotify_id).first()
             if not user:
                 return {'error': 'User not found'}, 404
@@ -76,7 +108,7 @@ def init_routes(app):
                 'display_name': user.display_name,
                 'profile_image': user.profile_image,
                 'created_at': user.created_at.isoformat()
-            }
+            }, 200, etag_headers(etag)
 
     @api.route('/create_user')
     class CreateUser(Resource):
@@ -191,72 +223,78 @@ def init_routes(app):
                 return {'error': str(e)}, 500
 
 
+    def requested_playlist_size(data):
+        # playlist_size from a /create_recs body: (size, None), or (None, error) when it's out of range
+        playlist_size = data.get('playlist_size')
+        if playlist_size is None:
+            return current_app.config.get('PLAYLIST_SIZE_DEFAULT', 20), None
+        max_size = current_app.config.get('PLAYLIST_SIZE_MAX', 500)
+        if not 1 <= playlist_size <= max_size:
+            return None, {'error': f'playlist_size must be between 1 and {max_size}'}
+        return playlist_size, None
+
     # Prompt routes
     # AI Generated with ChatGPT due to repetitive code
+    def prompt_history(user_id):
+        # one page of a user's prompts with their playlists, the next page's cursor goes in X-Next-Cursor
+        limit = request.args.get('limit', current_app.config.get('PROMPT_HISTORY_PAGE_SIZE', 50), type=int)
+        limit = max(1, min(limit, current_app.config.get('PROMPT_HISTORY_MAX_PAGE_SIZE', 200)))
+        cursor = request.args.get('cursor')
+        try:
+            etag, not_modified = check_etag(
+                user_prompts_page_version(user_id, limit, cursor), 'prompts', user_id, limit, cursor
+            )
+            if not_modified:
+                return not_modified
+            prompts, next_cursor = get_user_prompts_page(user_id, limit, cursor)
+        except InvalidCursor as e:
+            return {'error': str(e)}, 400
+
+        headers = etag_headers(etag)
+        if next_cursor:
+            headers['X-Next-Cursor'] = next_cursor
+        return [serialize_prompt(prompt) for prompt in prompts], 200, headers
+
     @api.route('/get_prompt/<prompt_id>')
     class GetPrompt(Resource):
         @api.doc(description="Get a specific prompt by ID.")
         @api.response(200, 'Prompt found')
+        @api.response(304, 'Not modified')
         @api.response(404, 'Prompt not found')
         def get(self, prompt_id):
-            prompt = Prompt.query.get(prompt_id)
+            etag, not_modified = check_etag(prompt_version(prompt_id), 'prompt', prompt_id)
+            if not_modified:
+                return not_modified
+
+            prompt = Prompt.query.options(joinedload(Prompt.playlist)).filter_by(id=prompt_id).first()
             if not prompt:
                 return {'error': 'Prompt not found'}, 404
 
-            return {
-                'id': str(prompt.id),
-                'user_id': str(prompt.user_id),
-                'mood': prompt.mood,
-                'additional_notes': prompt.additional_notes,
-                'created_at': prompt.created_at.isoformat(),
-                'playlist': {
-                    'id': str(prompt.playlist.id),
-                    'spotify_playlist_id': prompt.playlist.spotify_playlist_id,
-                    'playlist_name': prompt.playlist.playlist_name
-                } if prompt.playlist else None
-            }
+            return serialize_prompt(prompt), 200, etag_headers(etag)
         
     @api.route('/get_prompts/<user_id>')
     class GetUserPrompts(Resource):
-        @api.doc(description="Get all prompts for a user.")
+        @api.doc(description="Get a user's prompts, newest first. Pass the X-Next-Cursor response header back as cursor for the next page.")
+        @api.param('limit', 'Page size')
+        @api.param('cursor', 'Cursor from the previous page')
         @api.response(200, 'Prompts found')
+        @api.response(304, 'Not modified')
         def get(self, user_id):
-            prompts = Prompt.query.filter_by(user_id=user_id).all()
-            return [{
-                'id': str(prompt.id),
-                'user_id': str(prompt.user_id),
-                'mood': prompt.mood,
-                'additional_notes': prompt.additional_notes,
-                'created_at': prompt.created_at.isoformat(),
-                'playlist': {
-                    'id': str(prompt.playlist.id),
-                    'spotify_playlist_id': prompt.playlist.spotify_playlist_id,
-                    'playlist_name': prompt.playlist.playlist_name
-                } if prompt.playlist else None
-            } for prompt in prompts]
+            return prompt_history(user_id)
     
     @api.route('/get_prompts_by_spotify_id/<spotify_id>')
     class GetUserPromptsBySpotifyId(Resource):
-        @api.doc(description="Get all prompts for a user by their Spotify ID.")
+        @api.doc(description="Get a user's prompts by their Spotify ID, newest first. Pass the X-Next-Cursor response header back as cursor for the next page.")
+        @api.param('limit', 'Page size')
+        @api.param('cursor', 'Cursor from the previous page')
         @api.response(200, 'Prompts found')
+        @api.response(304, 'Not modified')
         def get(self, spotify_id):
             user = User.query.filter_by(spotify_id=spotify_id).first()
             if not user:
                 return {'error': 'User not found'}, 404
 
-            prompts = Prompt.query.filter_by(user_id=user.id).all()
-            return [{
-                'id': str(prompt.id),
-                'user_id': str(prompt.user_id),
-                'mood': prompt.mood,
-                'additional_notes': prompt.additional_notes,
-                'created_at': prompt.created_at.isoformat(),
-                'playlist': {
-                    'id': str(prompt.playlist.id),
-                    'spotify_playlist_id': prompt.playlist.spotify_playlist_id,
-                    'playlist_name': prompt.playlist.playlist_name
-                } if prompt.playlist else None
-            } for prompt in prompts]
+            return prompt_history(user.id)
 
     @api.route('/create_prompt')
     class CreatePrompt(Resource):
@@ -293,8 +331,13 @@ def init_routes(app):
     class GetPlaylist(Resource):
         @api.doc(description="Get a playlist by its ID with its tracks.")
         @api.response(200, 'Playlist found')
+        @api.response(304, 'Not modified')
         @api.response(404, 'Playlist not found')
         def get(self, playlist_id):
+            etag, not_modified = check_etag(playlist_version(playlist_id), 'playlist', playlist_id)
+            if not_modified:
+                return not_modified
+
             playlist = Playlist.query.get(playlist_id)
             if not playlist:
                 return {'error': 'Playlist not found'}, 404
@@ -311,7 +354,7 @@ def init_routes(app):
                     'track_name': track.track_name,
                     'artist_name': track.artist_name
                 } for track in playlist.tracks]
-            }
+            }, 200, etag_headers(etag)
 
     @api.route('/create_playlist')
     class CreatePlaylist(Resource):
@@ -369,6 +412,58 @@ def init_routes(app):
             db.session.commit()
             
             return {'message': 'Track added successfully'}, 201
+
+    @api.route('/add_tracks/<playlist_id>')
+    class AddTracks(Resource):
+        @api.expect(playlist_tracks_model, validate=True)
+        @api.doc(description="Add many tracks to a playlist in one statement. Tracks already in the playlist are skipped.")
+        @api.response(201, 'Tracks added successfully')
+        @api.response(404, 'Playlist not found')
+        def post(self, playlist_id):
+            tracks = request.get_json()['tracks']
+
+            try:
+                added = bulk_insert_playlist_tracks(playlist_id, tracks)
+                db.session.commit()
+            except (IntegrityError, DataError):
+                # the only foreign key is the playlist, so no separate existence query is needed;
+                # an id that isn't a uuid (DataError on postgres) can't be a playlist either
+                db.session.rollback()
+                return {'error': 'Playlist not found'}, 404
+
+            return {
+                'message': 'Tracks added successfully',
+                'added': added,
+                'skipped': len(tracks) - added
+            }, 201
+
+    @api.route('/cache_stats')
+    class CacheStats(Resource):
+        @api.doc(description="Get size and hit/miss counters for this worker's caches.")
+        @api.response(200, 'Cache stats')
+        def get(self):
+            return cache_stats()
+
+    @api.route('/rate_limit_stats')
+    class RateLimitStats(Resource):
+        @api.doc(description="Get queue depth and throttle counters for this worker's Spotify rate limiters.")
+        @api.response(200, 'Rate limit stats')
+        def get(self):
+            return rate_limit_stats()
+
+    @api.route('/pool_stats')
+    class PoolStats(Resource):
+        @api.doc(description="Get checked-out, overflow and wait counters for this worker's database connection pool.")
+        @api.response(200, 'Pool stats')
+        def get(self):
+            return pool_stats(db.engine)
+
+    @api.route('/metrics')
+    class Metrics(Resource):
+        @api.doc(description="Prometheus metrics: /create_recs stage timings, outbound Spotify/Gemini calls, request latency.")
+        @api.response(200, 'Metrics in the Prometheus text format')
+        def get(self):
+            return metrics_response()
     
 
     
@@ -386,139 +481,32 @@ def init_routes(app):
             if not prompt or not spotify_id:
                 return {'error': 'Missing prompt or Spotify ID'}, 400 
 
-            track_uris = []
-
             # Get user from database
             user = User.query.filter_by(spotify_id=spotify_id).first()
             if not user:
                 return {'error': 'User not found'}, 404
-            
-            # Create prompt in database
-            new_prompt = Prompt(
-                user_id=user.id,
-                mood=prompt,
-                additional_notes=None
-            )
-            db.session.add(new_prompt)
-            db.session.flush()
-            prompt_id = new_prompt.id
-
-            # Get Spotify user data (top tracks and top artists) JOSHUA
-            top_data, error = get_spotify_top_data(access_token)
-            print(f"TOP DATA: {top_data}")
-            if error:
-                return error, 500
-            if top_data:
-                top_tracks = top_data['top_tracks']
-                top_artists = top_data['top_artists']
-            
-            # Send user data (JSON should incl genre for artists) and prompt to Gemini (should return seed_tracks, seed_artists, and seed_genres) AALEIA
-            
-            top_artists_formatted = [{
-                "name": artist["name"],
-                "genres": artist.get("genres", []),
-                "popularity": artist.get("popularity", 0)
-            } for artist in top_artists.get("items", [])]
-
-            top_tracks_formatted = [{
-                "title": track["name"],
-                "artist": track["artists"][0]["name"] if track.get("artists") else ""
-            } for track in top_tracks.get("items", [])]
-
-            top_artists_json = json.dumps(top_artists_formatted)
-            top_tracks_json = json.dumps(top_tracks_formatted)
 
-            gemini_response_parts = get_gemini_recommendation(prompt, top_artists_json, top_tracks_json)
+            use_cache = not data.get('no_cache')
 
-            if isinstance(gemini_response_parts, dict) and "error" in gemini_response_parts:
-                return gemini_response_parts, 500
-
-            # 1. extract text from Gemini parts
-            full_text = ""
-            for part in gemini_response_parts:
-                if hasattr(part, 'text'):
-                    full_text += part.text
-
-            # 2. extract JSON string from the full text
-            json_match = re.search(r"```(?:json)?\n?([\s\S]*?)\n?```", full_text, re.DOTALL)
-            if json_match:
-                json_string = json_match.group(1).strip()
-            else:
-                json_string = full_text.strip()
-
-            current_app.logger.info(f"Gemini JSON Response: {json_string}")
-
-            # 3. parse the JSON string
-            try:
-                recommendations = json.loads(json_string)
-            except json.JSONDecodeError as e:
-                current_app.logger.error(f"JSONDecodeError: {e} - Raw response: {json_string}")
-                return {'error': 'Invalid JSON from Gemini', 'raw': json_string}, 500
-
-            if not recommendations:
-                return {'error': 'No songs extracted from Gemini response', 'raw': full_text}, 500
-            current_app.logger.info(f"Extracted recommendations: {recommendations}")
-
-            # 4. search for track URIs on Spotify
-            track_uris, tracks, not_found = get_track_uris_from_spotify(access_token, recommendations)  #combine track search
-            current_app.logger.info(f"Tracks: {tracks}")
-            if not track_uris and not not_found:
-                return {'error': 'No tracks found on Spotify', 'recommendations': recommendations}, 500
-
-            # 5. get user ID from Spotify
-            user_id, error = get_user_id(access_token)
-            if error:
-                return {'error': 'Could not get user ID', 'details': error}, 500
-
-            # 6. create playlist
-            playlist_name = f"{prompt} Vibes"
-            playlist_description = f"Playlist generated from your prompt: {prompt}"
-            playlist_data, error = create_spotify_playlist(access_token, user_id, playlist_name, track_uris)
-            if error:
-                return {'error': 'Failed to create Spotify playlist', 'details': error}, 500
-
-            playlist_id = playlist_data['id']
-
-            # 7 create playlist in database
-            new_playlist = Playlist(
-                user_id=user.id,
-                prompt_id=prompt_id,
-                spotify_playlist_id=playlist_id,
-                playlist_name=playlist_name
-            )
-            db.session.add(new_playlist)
-            db.session.flush()
-
-            # 7.5 add tracks to database
-            for track in tracks:
-                new_track = PlaylistTrack(
-                    playlist_id=new_playlist.id,
-                    spotify_track_id=track['uri'],
-                    track_name=track['name'],
-                    artist_name=track['artist']
-                )
-                db.session.add(new_track)
-            db.session.commit()
-
-            # 8. add tracks to the playlist
-            result = add_tracks_spotify_playlist(access_token, playlist_id, track_uris)
-            if isinstance(result, tuple):
-                response_data, error = result[:2]  #take first two elements
-            else:
-                response_data = result
-                error = None
+            playlist_size, error = requested_playlist_size(data)
             if error:
-                return {'error': 'Failed to add tracks to playlist', 'details': error}, 500
+                return error, 400
 
-            return {
-                'message': 'Playlist created successfully!',
-                'playlist_id': playlist_id,
-                'playlist_name': playlist_name,
-                'track_count': len(track_uris),
-                'not_found': not_found,
-                'recommendations': recommendations  # inc the parsed recommendations
-            }, 201
+            # async mode: queue the pipeline on the background workers and let the client poll the job
+            if data.get('async') or request.args.get('async') == 'true':
+                job = RecJob(user_id=user.id, prompt=prompt)
+                db.session.add(job)
+                db.session.commit()
+                submit_create_recs_job(current_app._get_current_object(), job.id, user.id, prompt, access_token, use_cache,
+                                       playlist_size)
+                status_url = api.url_for(CreateRecsJob, job_id=job.id)
+                return {
+                    'job_id': str(job.id),
+                    'status': job.status,
+                    'status_url': status_url
+                }, 202, {'Location': status_url}
 
+            return run_create_recs(user, prompt, access_token, use_cache=use_cache, playlist_size=playlist_size)
 
         # Route to test creating playlist, and adding user's saved tracks
         @api.route('/api/spotify/create_playlist_test', methods=['POST'])
@@ -538,15 +526,17 @@ def init_routes(app):
                 saved_tracks_data, error = get_spotify_saved_tracks(access_token, limit=10)
                 if error:
                     return error, 400
-                track_ids = [track['track']['id'] for track in saved_tracks_data['items']]
+                saved_tracks = [item['track'] for item in saved_tracks_data['items']]
 
-                # convert track ids to track_uris
-                track_uris = []
-                for track_id in track_ids:
-                    track_uri, error = get_track_uri(access_token, track_id)
+                # take track uris from the saved tracks payload, batch look up any that are missing
+                track_uris = [get_uri_from_track(track) for track in saved_tracks]
+                missing = [i for i, uri in enumerate(track_uris) if not uri]
+                if missing:
+                    uris, error = get_track_uris(access_token, [saved_tracks[i]['id'] for i in missing])[:2]
                     if error:
                         return error, 400
-                    track_uris.append(track_uri)
+                    for i, uri in zip(missing, uris):
+                        track_uris[i] = uri
                 
                 # create playlist
                 playlist_name = 'Create Playlist Test'
@@ -562,69 +552,52 @@ def init_routes(app):
                     return error, 400
 
                 return {'message': 'Test playlist created and saved tracks added successfully', 'playlist_id': playlist_id}, 201
-    
-    return api
 
+    @api.route('/create_recs/batch')
+    class CreateRecsBatch(Resource):
+        @api.expect(recommendation_batch_model, validate=True)
+        @api.doc(description="Generate a playlist for each of several prompts, fetching the user's taste data once")
+        @api.response(201, 'At least one playlist created, see each entry of playlists')
+        @api.response(400, 'Invalid prompts or playlist_size, or more than CREATE_RECS_BATCH_MAX_SONGS songs in total')
+        @api.response(404, 'User not found')
+        def post(self):
+            data = request.get_json()
+            prompts = [prompt.strip() for prompt in data.get('prompts') or [] if prompt and prompt.strip()]
+            spotify_id = data.get('spotify_id')
+            access_token = data.get('access_token')
 
-from urllib.parse import quote
-import requests
-
-def get_track_uris_from_spotify(access_token, recommendations):
-    """
-    Searches for track URIs on Spotify and returns a list of URIs and a list of not found tracks.
-    Uses the get_track_uri helper function.
-    """
-    track_uris = []
-    not_found = []
-    tracks = []
-    for rec in recommendations:
-        track_name = rec.get('track')
-        artist_name = rec.get('artist')
-
-        if not track_name or not artist_name:
-            print(f"Skipping invalid recommendation: {rec}")
-            not_found.append(rec)
-            continue
-
-        # strict search query, might need something looser for inaccurate gemini track recommendations.    
-        query = f'track:"{track_name}" artist:"{artist_name}"'
-        
-        #search for the track
-        headers = {'Authorization': f'Bearer {access_token}'}
-        params = {'q': query, 'type': 'track', 'limit': 1}
-        response = requests.get("https://api.spotify.com/v1/search", headers=headers, params=params)
-
-        if response.status_code == 200:
-            items = response.json().get("tracks", {}).get("items", [])
-            if items:
-                track_id = items[0]["id"]
-                track_uri, uri_error = get_track_uri(access_token, track_id)  #use the helper
-                if uri_error:
-                    current_app.logger.error(f"Error getting URI for track {query}: {uri_error}")
-                    not_found.append(rec)
-                else:
-                    track_uris.append(track_uri)
-                    tracks.append({"uri": track_uri, "name": track_name, "artist": artist_name})
-            else:
-                # if strict search fails, do loose search (not accurate).
-                loose_query = f"{quote(track_name)} {quote(artist_name)}"
-                params['q'] = loose_query
-                response = requests.get("https://api.spotify.com/v1/search", headers=headers, params=params)
-
-                if response.status_code == 200:
-                    items = response.json().get("tracks", {}).get("items", [])
-                    if items:
-                        track_id = items[0]["id"]
-                        track_uri, uri_error = get_track_uri(access_token, track_id)  #use the helper
-                        if uri_error:
-                            current_app.logger.error(f"Error getting URI for track {query}: {uri_error}")
-                            not_found.append(rec)
-                        else:
-                            track_uris.append(track_uri)
-                            tracks.append({"uri": track_uri, "name": track_name, "artist": artist_name})
-                    else:
-                        not_found.append(rec) 
-        else:
-            print(f"Spotify search failed for {query}: {response.json()}")
-            not_found.append(rec)  #add to not found, and continue
-    return track_uris, tracks, not_found
+            if not prompts or not spotify_id:
+                return {'error': 'Missing prompts or Spotify ID'}, 400
+            max_prompts = current_app.config.get('CREATE_RECS_BATCH_MAX_PROMPTS', 10)
+            if len(prompts) > max_prompts:
+                return {'error': f'At most {max_prompts} prompts per batch'}, 400
+
+            playlist_size, error = requested_playlist_size(data)
+            if error:
+                return error, 400
+            max_songs = current_app.config.get('CREATE_RECS_BATCH_MAX_SONGS', 200)
+            if len(prompts) * playlist_size > max_songs:
+                return {'error': f'At most {max_songs} songs per batch (prompts x playlist_size), '
+                                 'use /create_recs with async for larger playlists'}, 400
+
+            user = User.query.filter_by(spotify_id=spotify_id).first()
+            if not user:
+                return {'error': 'User not found'}, 404
+
+            return run_create_recs_batch(user, prompts, access_token, use_cache=not data.get('no_cache'),
+                                         playlist_size=playlist_size)
+
+    @api.route('/create_recs/<job_id>')
+    class CreateRecsJob(Resource):
+        @api.doc(description="Get the progress and result of an asynchronous /create_recs job")
+        @api.response(200, 'Job found')
+        @api.response(404, 'Job not found')
+        def get(self, job_id):
+            # an id that isn't a uuid can't be a job (and postgres would raise DataError on it)
+            job = db.session.get(RecJob, job_id) if is_uuid(job_id) else None
+            if not job:
+                return {'error': 'Job not found'}, 404
+            expire_stale_job(job, current_app.config.get('REC_JOB_STALE_SECONDS', 600))
+            return serialize_job(job)
+    
+    return api
@@ -0,0 +1,17 @@
+# Shared dict builders for API responses
+
+
+def serialize_prompt(prompt):
+    # prompt.playlist should be eager loaded by the caller when serializing many prompts
+    return {
+        'id': str(prompt.id),
+        'user_id': str(prompt.user_id),
+        'mood': prompt.mood,
+        'additional_notes': prompt.additional_notes,
+        'created_at': prompt.created_at.isoformat(),
+        'playlist': {
+            'id': str(prompt.playlist.id),
+            'spotify_playlist_id': prompt.playlist.spotify_playlist_id,
+            'playlist_name': prompt.playlist.playlist_name
+        } if prompt.playlist else None
+    }
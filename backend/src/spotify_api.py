@@ -1,10 +1,31 @@
-import requests 
-from flask import request, jsonify
+from flask import request, jsonify, Response, stream_with_context, current_app
 from flask_restx import Api, Resource, fields
 from urllib.parse import quote
+from src.spotify_client import get_spotify_client
+from src.spotify_helpers import get_spotify_top_data, iter_spotify_saved_tracks, SpotifyPageError
+from src.json_output import dumps
 
 
 
+def stream_saved_tracks(access_token):
+    # pages are fetched concurrently in the background and written out as they arrive, one saved track per line
+    result, error = iter_spotify_saved_tracks(access_token, concurrency=current_app.config.get('SAVED_TRACKS_CONCURRENCY', 4))
+    if error:
+        return {'error': 'Failed to get saved tracks'}, 500
+    total, items = result
+    backend = current_app.config.get('JSON_BACKEND', 'orjson')
+
+    def generate():
+        try:
+            for item in items:
+                yield dumps(item, backend) + b'\n'
+        except SpotifyPageError as e:
+            # headers are already sent, so report the failure as the last line
+            yield dumps({'error': str(e)}, backend) + b'\n'
+
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson', headers={'X-Total-Count': str(total)})
+
+
 def init_spotify_api(api):
     # Spotify Web API endpoints
 
@@ -16,24 +37,12 @@ def init_spotify_api(api):
             access_token = request.args.get('access_token')
             if not access_token:
                 return {'error': 'Access token is missing'}, 400
-            headers = {'Authorization': f'Bearer {access_token}'}
+            # served from the per-user top data cache when it's fresh
+            top_data, error = get_spotify_top_data(access_token)
+            if error:
+                return error, 500
 
-            # call spotify endpoints for top tracks and top artists
-            top_tracks_response = requests.get('https://api.spotify.com/v1/me/top/tracks', headers=headers)
-            if top_tracks_response.status_code != 200:
-                return {'error': 'Failed to get top tracks'}, 500
-            
-            top_artists_response = requests.get('https://api.spotify.com/v1/me/top/artists', headers=headers)
-            if top_artists_response.status_code != 200:
-                return {'error': 'Failed to get top artists'}, 500
-            
-            top_tracks = top_tracks_response.json()
-            top_artists = top_artists_response.json()
-
-            return {
-                'top_tracks': top_tracks,
-                'top_artists': top_artists
-            }
+            return top_data
         
         # Route to get spotify current user
         @api.route('/api/spotify/me', methods=['GET'])
@@ -43,10 +52,9 @@ def init_spotify_api(api):
                 if not access_token:
                     return {'error': 'Access token is missing'}, 400
                 
-                headers = {'Authorization': f'Bearer {access_token}'}
-                spotify_user_url = 'https://api.spotify.com/v1/me'
+                spotify_user_url = '/me'
 
-                response = requests.get(spotify_user_url, headers=headers)
+                response = get_spotify_client().get(spotify_user_url, access_token)
 
                 if response.status_code == 200:
                     return response.json()
@@ -60,10 +68,9 @@ def init_spotify_api(api):
                 if not access_token:
                     return {'error': 'Access token is missing'}, 400
                 
-                headers = {'Authorization': f'Bearer {access_token}'}
-                get_track_url = f'https://api.spotify.com/v1/tracks/{track_id}'
+                get_track_url = f'/tracks/{track_id}'
 
-                response = requests.get(get_track_url, headers=headers)
+                response = get_spotify_client().get(get_track_url, access_token)
                 
                 if response.status_code == 200:
                     return response.json()
@@ -87,15 +94,14 @@ def init_spotify_api(api):
                 if not user_id or not playlist_name:
                     return {'error': 'Need user_id and playlist name to create Playlist'}, 400
 
-                headers = {'Authorization': f'Bearer {access_token}', 'Content-Type': 'application/json'}
                 playlist_data = {
                     'name': playlist_name,
                     'description': playlist_description,
                     'public': playlist_public
                 }
 
-                create_playlist_url = f'https://api.spotify.com/v1/users/{user_id}/playlists'
-                response = requests.post(create_playlist_url, json=playlist_data, headers=headers)
+                create_playlist_url = f'/users/{user_id}/playlists'
+                response = get_spotify_client().post(create_playlist_url, access_token, json=playlist_data)
 
                 if response.status_code != 201:
                     return {'error': 'Failed to create playlist'}, 500
@@ -118,13 +124,12 @@ def init_spotify_api(api):
                 if not playlist_id or not track_uris:
                     return {'error': 'Need playlist ID and track URIs to add tracks'}, 400
                 
-                headers = {'Authorization': f'Bearer {access_token}', 'Content-Type': 'application/json'}
                 tracks_data = {
                     'uris': track_uris
                 }
 
-                add_tracks_url = f'https://api.spotify.com/v1/playlists/{playlist_id}/tracks'
-                response = request.post(add_tracks_url, json=tracks_data, headers=headers)
+                add_tracks_url = f'/playlists/{playlist_id}/tracks'
+                response = get_spotify_client().post(add_tracks_url, access_token, json=tracks_data)
 
                 if response.status_code != 201:
                     return {'error': 'Failed to add tracks to playlist'}, 500
@@ -134,22 +139,26 @@ def init_spotify_api(api):
     # Route to get current user's saved tracks
     @api.route('/api/spotify/saved_tracks', methods=['GET'])
     class SpotifyGetSavedTracks(Resource):
+        @api.doc(description="Get the current user's saved tracks. With all=true, every saved track is streamed as NDJSON, one track per line.")
+        @api.param('all', 'Stream the whole library as NDJSON instead of returning one page')
         def get(self):
             access_token = request.args.get('access_token')
             if not access_token:
                 return {'error': 'Access token is missing'}, 400
+
+            if request.args.get('all') == 'true':
+                return stream_saved_tracks(access_token)
             
-            headers = {'Authorization': f'Bearer {access_token}'}
-            saved_tracks_url = 'https://api.spotify.com/v1/me/tracks'
+            saved_tracks_url = '/me/tracks'
 
-            response = requests.get(saved_tracks_url, headers=headers)
+            response = get_spotify_client().get(saved_tracks_url, access_token)
 
             if response.status_code != 200:
                 return {'error': 'Failed to get saved tracks'}, 500
             
             saved_tracks_data = response.json()
 
-            return jsonify(saved_tracks_data), 200
+            return saved_tracks_data, 200
 
     # End of Spotify Web API endpoints, including fetching access token from frontend
 
@@ -0,0 +1,154 @@
+import os
+import threading
+import time
+import requests
+from requests.adapters import HTTPAdapter
+from http.cookiejar import DefaultCookiePolicy
+from src.rate_limiter import get_scheduler, current_priority, RateLimitTimeout
+from src.metrics import observe_outbound, spotify_endpoint
+
+# Shared HTTP client for the Spotify Web API, used by spotify_helpers.py and spotify_api.py
+
+SPOTIFY_API_BASE_URL = 'https://api.spotify.com/v1'
+
+
+class SpotifyClient:
+    """
+    Pooled client for the Spotify Web API.
+    One requests.Session keeps connections to api.spotify.com alive, so calls skip the TCP+TLS handshake.
+    The session isn't mutated after it's built (auth headers are passed per request, cookies are blocked),
+    so a single client can be shared by every thread in a worker.
+    Every request first takes a token from the credential's shared RateLimitScheduler, waiting at most max_queue_wait
+    seconds (then a 429 is returned without calling Spotify); a 429 pauses the scheduler for Retry-After (plus
+    jittered backoff) and is retried up to max_429_retries times, unless Spotify asks for a wait longer than
+    max_retry_after. The pause is never longer than max_retry_after, so one long Retry-After can't stall every
+    Spotify call in the process.
+    """
+
+    def __init__(self, base_url=SPOTIFY_API_BASE_URL, pool_connections=10, pool_maxsize=32, timeout=10, max_retries=0,
+                 scheduler=None, max_429_retries=3, max_retry_after=10, max_queue_wait=30):
+        self.base_url = base_url.rstrip('/')
+        self.timeout = timeout
+        self.scheduler = scheduler
+        self.max_429_retries = max_429_retries
+        self.max_retry_after = max_retry_after
+        self.max_queue_wait = max_queue_wait
+
+        self.session = requests.Session()
+        self.session.cookies.set_policy(DefaultCookiePolicy(allowed_domains=[]))
+        adapter = HTTPAdapter(pool_connections=pool_connections, pool_maxsize=pool_maxsize, max_retries=max_retries)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+    def url(self, path):
+        # accept full urls too (e.g. the "next" links spotify returns for paging)
+        if path.startswith('http://') or path.startswith('https://'):
+            return path
+        return f"{self.base_url}/{path.lstrip('/')}"
+
+    def request(self, method, path, access_token=None, headers=None, **kwargs):
+        request_headers = {}
+        if access_token:
+            request_headers['Authorization'] = f'Bearer {access_token}'
+        if headers:
+            request_headers.update(headers)
+
+        kwargs.setdefault('timeout', self.timeout)
+        url = self.url(path)
+        endpoint = spotify_endpoint(url)
+        priority = current_priority()
+
+        attempt = 0
+        while True:
+            if self.scheduler:
+                try:
+                    self.scheduler.acquire(priority, self.max_queue_wait)
+                except RateLimitTimeout:
+                    observe_outbound('spotify', endpoint, 'queue_timeout', 0)
+                    return rate_limited_response(url, self.max_queue_wait)
+            start = time.perf_counter()
+            try:
+                response = self.session.request(method, url, headers=request_headers, **kwargs)
+            except requests.RequestException:
+                observe_outbound('spotify', endpoint, 'error', time.perf_counter() - start)
+                raise
+            observe_outbound('spotify', endpoint, response.status_code, time.perf_counter() - start)
+            if response.status_code != 429 or not self.scheduler:
+                return response
+
+            retry_after = parse_retry_after(response.headers.get('Retry-After'))
+            if attempt >= self.max_429_retries or retry_after > self.max_retry_after:
+                # giving up: still back off, but no longer than max_retry_after
+                self.scheduler.throttle(min(retry_after, self.max_retry_after), attempt)
+                return response
+            self.scheduler.throttle(retry_after, attempt)
+            attempt += 1
+
+    def get(self, path, access_token=None, **kwargs):
+        return self.request('GET', path, access_token, **kwargs)
+
+    def post(self, path, access_token=None, **kwargs):
+        return self.request('POST', path, access_token, **kwargs)
+
+    def close(self):
+        self.session.close()
+
+
+def rate_limited_response(url, retry_after):
+    """A 429 for a request that was never sent because the rate limit queue was too long."""
+    response = requests.Response()
+    response.status_code = 429
+    response.url = url
+    response.headers['Retry-After'] = str(int(retry_after))
+    response.headers['Content-Type'] = 'application/json'
+    response._content = b'{"error": {"status": 429, "message": "Rate limit queue wait exceeded"}}'
+    return response
+
+
+def parse_retry_after(value, default=1):
+    # spotify sends Retry-After in seconds
+    try:
+        return max(float(value), 0)
+    except (TypeError, ValueError):
+        return default
+
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_spotify_client():
+    """Returns the process-wide SpotifyClient, built from environment variables on first use."""
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = SpotifyClient(
+                    base_url=os.getenv('SPOTIFY_API_BASE_URL', SPOTIFY_API_BASE_URL),
+                    pool_connections=int(os.getenv('SPOTIFY_POOL_CONNECTIONS', 10)),
+                    pool_maxsize=int(os.getenv('SPOTIFY_POOL_MAXSIZE', 32)),
+                    timeout=float(os.getenv('SPOTIFY_TIMEOUT', 10)),
+                    max_retries=int(os.getenv('SPOTIFY_MAX_RETRIES', 0)),
+                    # one bucket per Spotify app credential, shared by every thread in this process
+                    scheduler=get_scheduler(
+                        os.getenv('SPOTIFY_CLIENT_ID', 'default'),
+                        rate=float(os.getenv('SPOTIFY_RATE_LIMIT', 20)),
+                        burst=int(os.getenv('SPOTIFY_RATE_LIMIT_BURST', 40))
+                    ),
+                    max_429_retries=int(os.getenv('SPOTIFY_429_RETRIES', 3)),
+                    max_retry_after=float(os.getenv('SPOTIFY_MAX_RETRY_AFTER', 10)),
+                    # seconds a call may wait for a rate limit token before failing with a 429
+                    max_queue_wait=float(os.getenv('SPOTIFY_MAX_QUEUE_WAIT', 30))
+                )
+    return _client
+
+
+def reset_spotify_client():
+    # pooled sockets must not be shared between a parent process and its forked workers
+    global _client, _client_lock
+    _client = None
+    _client_lock = threading.Lock()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=reset_spotify_client)
@@ -1,24 +1,105 @@
-import requests 
 from urllib.parse import quote 
+from flask import current_app
+from src.spotify_client import get_spotify_client
+from src.cache import TTLCache, MISSING, get_cache
+from src.logger import logger
+from concurrent.futures import ThreadPoolExecutor
+from contextvars import copy_context
+from collections import deque
+import hashlib
+import time
+import requests
 
 # Spotify helper functions
 
+# Per-user cache for top tracks/artists, entries are {'payload', 'etag', 'fetched_at'}.
+# Entries are kept past TOP_DATA_CACHE_TTL so a stale one can be revalidated with If-None-Match (a 304 reuses it).
+def get_top_data_cache():
+    max_users = current_app.config.get('TOP_DATA_CACHE_MAX_USERS', 1000)
+    return get_cache('top_data', lambda: TTLCache(max_size=max_users * 2, ttl=None))
+
+# cache key for a user's top data: the spotify user the token belongs to, or the token itself if that lookup fails
+# (never a client supplied id, so one user can't read another user's cached data)
+def top_data_cache_key(access_token):
+    user_id, error = get_user_id(access_token)[:2]
+    if error:
+        return 'token:' + hash_token(access_token)
+    return f'user:{user_id}'
+
+# the cache key without calling /me, or None if the token's user isn't known yet
+def known_top_data_cache_key(access_token):
+    user_id = get_token_user_cache().get(hash_token(access_token))
+    return None if user_id is MISSING else f'user:{user_id}'
+
+# Fetch one of the current user's top endpoints ('tracks' or 'artists'), revalidating entry with its ETag if
+# there is one. Returns a new cache entry
+def fetch_spotify_top(access_token, kind, entry=MISSING):
+    headers = {}
+    if entry is not MISSING and entry['etag']:
+        headers['If-None-Match'] = entry['etag']
+
+    response = get_spotify_client().get(f'/me/top/{kind}', access_token, headers=headers)
+    if response.status_code == 304 and entry is not MISSING:
+        return dict(entry, fetched_at=time.monotonic()), None
+    if response.status_code != 200:
+        return None, {'error': f'Failed to get top {kind}'}
+
+    return {
+        'payload': response.json(),
+        'etag': response.headers.get('ETag'),
+        'fetched_at': time.monotonic()
+    }, None
+
+# Get one of the current user's top endpoints, served from the cache while fresh
+def get_spotify_top(access_token, kind, cache, cache_key, ttl):
+    entry = cache.get((cache_key, kind))
+    if entry is not MISSING and time.monotonic() - entry['fetched_at'] < ttl:
+        return entry['payload'], None
+
+    entry, error = fetch_spotify_top(access_token, kind, entry)
+    if error:
+        return None, error
+    cache.set((cache_key, kind), entry)
+    return entry['payload'], None
+
 # Get current user's top tracks and artists. Returns 20 tracks and 20 artists
+# Cached per spotify user for TOP_DATA_CACHE_TTL seconds
 def get_spotify_top_data(access_token):
     if not access_token:
         return None, {'error': 'Access token is not available'}
-    headers = {'Authorization': f'Bearer {access_token}'}
-
-    top_tracks_response = requests.get('https://api.spotify.com/v1/me/top/tracks', headers=headers)
-    if top_tracks_response.status_code != 200:
-        return None, {'error': 'Failed to get top tracks'}
-            
-    top_artists_response = requests.get('https://api.spotify.com/v1/me/top/artists', headers=headers)
-    if top_artists_response.status_code != 200:
-        return None, {'error': 'Failed to get top artists'}
-            
-    top_tracks = top_tracks_response.json()
-    top_artists = top_artists_response.json()
+    cache = get_top_data_cache()
+    cache_key = known_top_data_cache_key(access_token)
+    ttl = current_app.config.get('TOP_DATA_CACHE_TTL', 6 * 3600)
+
+    # the two endpoints are independent, so fetch them at the same time
+    if cache_key:
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            top_tracks_future = executor.submit(copy_context().run, get_spotify_top, access_token, 'tracks', cache, cache_key, ttl)
+            top_artists_future = executor.submit(copy_context().run, get_spotify_top, access_token, 'artists', cache, cache_key, ttl)
+            top_tracks, tracks_error = top_tracks_future.result()
+            top_artists, artists_error = top_artists_future.result()
+    else:
+        # a token we haven't seen: look up its user (/me) alongside the top fetches instead of before them,
+        # then store what they return under that user's key
+        with ThreadPoolExecutor(max_workers=3) as executor:
+            cache_key_future = executor.submit(copy_context().run, top_data_cache_key, access_token)
+            tracks_entry_future = executor.submit(copy_context().run, fetch_spotify_top, access_token, 'tracks')
+            artists_entry_future = executor.submit(copy_context().run, fetch_spotify_top, access_token, 'artists')
+            cache_key = cache_key_future.result()
+            tracks_entry, tracks_error = tracks_entry_future.result()
+            artists_entry, artists_error = artists_entry_future.result()
+        top_tracks = top_artists = None
+        if tracks_entry:
+            cache.set((cache_key, 'tracks'), tracks_entry)
+            top_tracks = tracks_entry['payload']
+        if artists_entry:
+            cache.set((cache_key, 'artists'), artists_entry)
+            top_artists = artists_entry['payload']
+
+    if tracks_error:
+        return None, tracks_error
+    if artists_error:
+        return None, artists_error
 
     return {
         'top_tracks': top_tracks,
@@ -30,12 +111,12 @@ def get_spotify_top_data(access_token):
 # Get spotify ids for each track in a list
 def get_spotify_ids_for_tracks(access_token, seed_tracks):
     track_id_list = []
-    headers = {'Authorization': f'Bearer {access_token}'}
+    spotify = get_spotify_client()
 
     for track in seed_tracks:
         track_id = None
         query = quote(track)
-        track_response = requests.get(f'https://api.spotify.com/v1/search?q={query}&type=track', headers=headers)
+        track_response = spotify.get(f'/search?q={query}&type=track', access_token)
 
         if track_response.status_code == 200 and 'tracks' in track_response.json():
             if track_response.json()['tracks']['items']:
@@ -49,12 +130,12 @@ def get_spotify_ids_for_tracks(access_token, seed_tracks):
 # Get spotify ids for each artist in a list
 def get_spotify_ids_for_artists(access_token, seed_artists):
     artists_id_list = []
-    headers = {'Authorization': f'Bearer {access_token}'}
+    spotify = get_spotify_client()
 
     for artist in seed_artists:
         artist_id = None
         query = quote(artist)
-        artist_response = requests.get(f'https://api.spotify.com/v1/search?q={query}&type=artist', headers=headers)
+        artist_response = spotify.get(f'/search?q={query}&type=artist', access_token)
 
         if artist_response.status_code == 200 and 'artists' in artist_response.json():
             if artist_response.json()['artists']['items']:
@@ -70,59 +151,74 @@ def create_spotify_playlist(access_token, user_id, playlist_name, playlist_descr
     if not access_token:
         return None, {'error': 'Access token is missing'}, 400
     
-    headers = {'Authorization': f'Bearer {access_token}', 'Content-Type': 'application/json'}
     playlist_data = {
         'name': playlist_name,
         'description': playlist_description,
         'public': playlist_public
     }
 
-    create_spotify_playlist_url = f'https://api.spotify.com/v1/users/{user_id}/playlists'
-    response = requests.post(create_spotify_playlist_url, json=playlist_data, headers=headers)
+    create_spotify_playlist_url = f'/users/{user_id}/playlists'
+    response = get_spotify_client().post(create_spotify_playlist_url, access_token, json=playlist_data)
 
     if response.status_code != 201:
         return None, {'error': 'Failed to create spotify playlist'}, 500
     else:
         return response.json(), None
 
-# function to add tracks to spotify playlist
+# Spotify takes at most 100 uris per add-tracks request
+PLAYLIST_ADD_CHUNK_SIZE = 100
+
+def add_tracks_error(response):
+    error_message = f"Failed to add tracks to spotify playlist. Status code: {response.status_code}, Response: {response.text}"
+    logger.warning(error_message)
+    return None, {'error': error_message}, response.status_code
+
+# function to add tracks to spotify playlist, in chunks of 100 uris appended one after another (so they keep
+# their order without relying on positions)
 def add_tracks_spotify_playlist(access_token, playlist_id, track_uris):
     if not access_token:
         return None, {'error': 'Access token is missing'}, 400
-    
-    headers = {'Authorization': f'Bearer {access_token}', 'Content-Type': 'application/json'}
-    tracks_data = {'uris': track_uris}
-
-    add_tracks_url = f'https://api.spotify.com/v1/playlists/{playlist_id}/tracks'
-    response = requests.post(add_tracks_url, json=tracks_data, headers=headers)
-    print(f"add_tracks_spotify_playlist response: {response.status_code}, {response.text}")
 
-    if response.status_code != 201:
-        error_message = f"Failed to add tracks to spotify playlist. Status code: {response.status_code}, Response: {response.text}"
-        print(error_message)
-        return None, {'error': error_message}, response.status_code
-    
+    add_tracks_url = f'/playlists/{playlist_id}/tracks'
+    chunks = [track_uris[i:i + PLAYLIST_ADD_CHUNK_SIZE] for i in range(0, len(track_uris), PLAYLIST_ADD_CHUNK_SIZE)] or [[]]
+    for chunk in chunks:
+        response = get_spotify_client().post(add_tracks_url, access_token, json={'uris': chunk})
+        logger.debug(f"add_tracks_spotify_playlist response: {response.status_code}, {response.text}")
+        if response.status_code != 201:
+            return add_tracks_error(response)
     return response.json(), None
 
+def hash_token(access_token):
+    return hashlib.sha256(access_token.encode()).hexdigest()
+
+# access tokens live for an hour, so the user id behind one is cached for that long
+def get_token_user_cache():
+    return get_cache('token_user', lambda: TTLCache(max_size=10000, ttl=3600))
+
 # function to get the current user's user_id
 def get_user_id(access_token):
     if not access_token:
         return None, {'error': 'Access token is missing'}, 400
+
+    token_user_cache = get_token_user_cache()
+    user_id = token_user_cache.get(hash_token(access_token))
+    if user_id is not MISSING:
+        return user_id, None
     
-    headers = {'Authorization': f'Bearer {access_token}'}
-    spotify_user_url = 'https://api.spotify.com/v1/me'
+    spotify_user_url = '/me'
 
-    response = requests.get(spotify_user_url, headers=headers)
+    response = get_spotify_client().get(spotify_user_url, access_token)
 
     if response.status_code != 200:
-        return None, {'error', 'Failed to get current user'}, 500
+        return None, {'error': 'Failed to get current user'}, 500
     
     user_data = response.json()
     user_id = user_data.get('id')
 
     if not user_id:
         return None, {'error': 'User ID not found'}, 500
-    
+
+    token_user_cache.set(hash_token(access_token), user_id)
     return user_id, None 
 
 
@@ -131,10 +227,9 @@ def get_track_uri(access_token, track_id):
     if not access_token:
         return None, {'error': 'Access token is missing'}, 400
     
-    headers = {'Authorization': f'Bearer {access_token}'}
-    track_url = f'https://api.spotify.com/v1/tracks/{track_id}'
+    track_url = f'/tracks/{track_id}'
 
-    response = requests.get(track_url, headers=headers)
+    response = get_spotify_client().get(track_url, access_token)
 
     if response.status_code != 200:
         return None, {'error': 'Failed to get track details'}, 500
@@ -147,21 +242,107 @@ def get_track_uri(access_token, track_id):
     
     return track_uri, None
 
+# Spotify's /v1/tracks endpoint accepts at most 50 ids per call
+SEVERAL_TRACKS_LIMIT = 50
+
+# function to get details for many tracks at once, batched into /v1/tracks?ids= calls of 50 ids
+# returns the track objects in the same order as track_ids (None for ids spotify doesn't know)
+def get_several_tracks(access_token, track_ids):
+    if not access_token:
+        return None, {'error': 'Access token is missing'}, 400
+
+    spotify = get_spotify_client()
+    tracks = []
+    for i in range(0, len(track_ids), SEVERAL_TRACKS_LIMIT):
+        batch = track_ids[i:i + SEVERAL_TRACKS_LIMIT]
+        response = spotify.get('/tracks', access_token, params={'ids': ','.join(batch)})
+
+        if response.status_code != 200:
+            return None, {'error': 'Failed to get track details'}, 500
+
+        tracks.extend(response.json().get('tracks', []))
+
+    return tracks, None
+
+# function to get track uris for a list of track ids, using the batched lookup above
+def get_track_uris(access_token, track_ids):
+    tracks, error = get_several_tracks(access_token, track_ids)[:2]
+    if error:
+        return None, error, 500
+
+    return [track.get('uri') if track else None for track in tracks], None
+
+# function to get a track's uri straight from a search / saved-tracks payload, None if it isn't included
+def get_uri_from_track(track):
+    if not track:
+        return None
+    return track.get('uri')
+
 # function to get current user's saved tracks, limit, offset optional (can use market as parameter too) 
 def get_spotify_saved_tracks(access_token, limit=20, offset=0):
     if not access_token:
         return None, {'error': 'Access token is missing'}, 400
     
-    headers = {'Authorization': f'Bearer {access_token}'}
-    saved_tracks_url = 'https://api.spotify.com/v1/me/tracks'
+    saved_tracks_url = '/me/tracks'
     params = {
         'limit': limit,
         'offset': offset
     }
 
-    response = requests.get(saved_tracks_url, headers=headers, params=params)
+    response = get_spotify_client().get(saved_tracks_url, access_token, params=params)
 
     if response.status_code == 200:
         return response.json(), None
     else:
         return None, {'error': 'Failed to retrieve saved tracks'}, 500
+
+# /me/tracks returns at most 50 items per page
+SAVED_TRACKS_PAGE_SIZE = 50
+
+class SpotifyPageError(Exception):
+    pass
+
+# function to iterate over all of the current user's saved tracks
+# the first page gives the total, the rest are fetched concurrently (at most `concurrency` pages in flight) and
+# yielded in order, so only a few pages are in memory at a time. returns (total, item generator), None
+# or None, error if the first page fails; a later page failing (bad status or network error) raises
+# SpotifyPageError from the generator
+def iter_spotify_saved_tracks(access_token, concurrency=4, page_size=SAVED_TRACKS_PAGE_SIZE):
+    first_page, error = get_spotify_saved_tracks(access_token, limit=page_size, offset=0)[:2]
+    if error:
+        return None, error
+
+    total = first_page.get('total', len(first_page.get('items', [])))
+
+    def fetch_page(offset):
+        try:
+            page, error = get_spotify_saved_tracks(access_token, limit=page_size, offset=offset)[:2]
+        except requests.RequestException as e:
+            # a timeout or reset mid-stream goes out as the same error line as a failed page
+            raise SpotifyPageError(f"Failed to retrieve saved tracks at offset {offset}: {e}")
+        if error:
+            raise SpotifyPageError(f"Failed to retrieve saved tracks at offset {offset}")
+        return page.get('items', [])
+
+    def items():
+        yield from first_page.get('items', [])
+
+        offsets = iter(range(page_size, total, page_size))
+        executor = ThreadPoolExecutor(max_workers=concurrency)
+        try:
+            in_flight = deque()
+            for offset in offsets:
+                in_flight.append(executor.submit(copy_context().run, fetch_page, offset))
+                if len(in_flight) >= concurrency:
+                    break
+            while in_flight:
+                page_items = in_flight.popleft().result()
+                next_offset = next(offsets, None)
+                if next_offset is not None:
+                    in_flight.append(executor.submit(copy_context().run, fetch_page, next_offset))
+                yield from page_items
+        finally:
+            # the client may stop reading early, don't leave queued pages behind
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    return (total, items()), None
@@ -0,0 +1,193 @@
+import re
+import threading
+import unicodedata
+from datetime import datetime, timedelta
+from flask import current_app
+from sqlalchemy import select, update, delete, or_, and_
+from sqlalchemy.dialects.postgresql import insert
+from src.cache import TTLCache, MISSING, get_cache
+from src.extensions import db
+from src.models import TrackResolution
+
+# Cache for (track, artist) -> Spotify track resolution, checked before searching Spotify.
+# Values are {'uri', 'id'} dicts, None records a search that found nothing (negative caching).
+
+KEY_SEPARATOR = '\x1f'
+
+
+def normalize_track_key(track_name, artist_name):
+    """Builds the cache key for a recommendation: case, accents, punctuation and extra whitespace are ignored."""
+    def normalize(value):
+        value = unicodedata.normalize('NFKD', value).encode('ascii', 'ignore').decode('ascii')
+        value = re.sub(r"[^\w\s]", ' ', value.casefold())
+        return ' '.join(value.split())
+    return f"{normalize(track_name)}{KEY_SEPARATOR}{normalize(artist_name)}"
+
+
+class TrackResolutionCache:
+    """Interface shared by the cache backends."""
+
+    # True when each get_many is a round trip, so callers should look keys up in batches
+    batch_lookups = False
+
+    def get_many(self, keys):
+        """Returns {key: value} for the keys that are cached (value None for cached misses)."""
+        raise NotImplementedError
+
+    def set_many(self, resolved):
+        """Stores {key: value}, a None value is cached as a miss with the shorter negative ttl."""
+        raise NotImplementedError
+
+    def stats(self):
+        raise NotImplementedError
+
+
+class MemoryTrackResolutionCache(TrackResolutionCache):
+    """Process-local LRU backend, every worker keeps its own copy."""
+
+    def __init__(self, max_size=10000, ttl=7 * 24 * 3600, negative_ttl=3600):
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self._cache = TTLCache(max_size=max_size, ttl=ttl)
+
+    def get_many(self, keys):
+        found = {}
+        for key in keys:
+            value = self._cache.get(key)
+            if value is not MISSING:
+                found[key] = value
+        return found
+
+    def set_many(self, resolved):
+        for key, value in resolved.items():
+            self._cache.set(key, value, ttl=self.ttl if value else self.negative_ttl)
+
+    def stats(self):
+        return dict(self._cache.stats(), backend='memory')
+
+
+class PostgresTrackResolutionCache(TrackResolutionCache):
+    """
+    Backend stored in the track_resolutions table, shared by every worker.
+    Uses its own connection and transaction, so it never commits the request's pending session changes.
+    Rows past their ttl are ignored; prune() drops them and the least recently used rows beyond max_size.
+    """
+
+    batch_lookups = True
+
+    def __init__(self, max_size=100000, ttl=7 * 24 * 3600, negative_ttl=3600, prune_every=500):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.prune_every = prune_every
+        self._lock = threading.Lock()
+        self._writes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def _fresh(self, now):
+        table = TrackResolution.__table__
+        return or_(
+            and_(table.c.spotify_uri.isnot(None), table.c.resolved_at > now - timedelta(seconds=self.ttl)),
+            and_(table.c.spotify_uri.is_(None), table.c.resolved_at > now - timedelta(seconds=self.negative_ttl))
+        )
+
+    def get_many(self, keys):
+        keys = list(keys)
+        if not keys:
+            return {}
+        table = TrackResolution.__table__
+        now = datetime.utcnow()
+
+        with db.engine.begin() as conn:
+            rows = conn.execute(
+                select(table.c.lookup_key, table.c.spotify_uri, table.c.spotify_track_id)
+                .where(table.c.lookup_key.in_(keys), self._fresh(now))
+            ).all()
+            if rows:
+                conn.execute(
+                    update(table)
+                    .where(table.c.lookup_key.in_([row.lookup_key for row in rows]))
+                    .values(last_used_at=now)
+                )
+
+        found = {
+            row.lookup_key: {'uri': row.spotify_uri, 'id': row.spotify_track_id} if row.spotify_uri else None
+            for row in rows
+        }
+        with self._lock:
+            self.hits += len(found)
+            self.misses += len(keys) - len(found)
+        return found
+
+    def set_many(self, resolved):
+        if not resolved:
+            return
+        now = datetime.utcnow()
+        rows = [{
+            'lookup_key': key,
+            'spotify_uri': value['uri'] if value else None,
+            'spotify_track_id': value['id'] if value else None,
+            'resolved_at': now,
+            'last_used_at': now
+        } for key, value in resolved.items()]
+
+        statement = insert(TrackResolution.__table__).values(rows)
+        statement = statement.on_conflict_do_update(
+            index_elements=['lookup_key'],
+            set_={
+                'spotify_uri': statement.excluded.spotify_uri,
+                'spotify_track_id': statement.excluded.spotify_track_id,
+                'resolved_at': statement.excluded.resolved_at,
+                'last_used_at': statement.excluded.last_used_at
+            }
+        )
+        with db.engine.begin() as conn:
+            conn.execute(statement)
+
+        with self._lock:
+            self._writes += len(rows)
+            should_prune = self._writes >= self.prune_every
+            if should_prune:
+                self._writes = 0
+        if should_prune:
+            self.prune()
+
+    def prune(self):
+        table = TrackResolution.__table__
+        now = datetime.utcnow()
+        with db.engine.begin() as conn:
+            conn.execute(delete(table).where(~self._fresh(now)))
+            # least recently used rows beyond max_size
+            keep = select(table.c.lookup_key).order_by(table.c.last_used_at.desc()).limit(self.max_size)
+            conn.execute(delete(table).where(table.c.lookup_key.notin_(keep.scalar_subquery())))
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'backend': 'postgres',
+            'max_size': self.max_size,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups else 0.0
+        }
+
+
+TRACK_CACHE_BACKENDS = {
+    'memory': MemoryTrackResolutionCache,
+    'postgres': PostgresTrackResolutionCache
+}
+
+
+def get_track_cache():
+    """Returns the configured resolution cache (TRACK_CACHE_BACKEND), or None when it's set to 'none'."""
+    config = current_app.config
+    backend = config.get('TRACK_CACHE_BACKEND', 'memory')
+    if backend == 'none':
+        return None
+
+    return get_cache('track_resolution', lambda: TRACK_CACHE_BACKENDS[backend](
+        max_size=config.get('TRACK_CACHE_MAX_SIZE', 10000),
+        ttl=config.get('TRACK_CACHE_TTL', 7 * 24 * 3600),
+        negative_ttl=config.get('TRACK_CACHE_NEGATIVE_TTL', 3600)
+    ))
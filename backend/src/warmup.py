@@ -0,0 +1,30 @@
+import time
+from src.extensions import db
+from src.gemini import get_model
+from src.spotify_client import get_spotify_client
+from src.logger import logger
+
+# Optional warm-up after a worker forks (gunicorn.conf.py, WARM_UP=true): loads what is otherwise built lazily
+# on the first request, so the first user on a new worker doesn't pay for it.
+
+
+def warm_up(app):
+    start = time.monotonic()
+    steps = [
+        ('gemini', get_model),
+        ('spotify client', get_spotify_client),
+        ('database pool', lambda: check_database(app))
+    ]
+    for name, step in steps:
+        try:
+            step()
+        except Exception:
+            # warming up is best effort, the request that needs it will retry and report the error
+            logger.exception(f"Warm-up step {name} failed")
+    logger.info(f"Worker warmed up in {time.monotonic() - start:.2f}s")
+
+
+def check_database(app):
+    with app.app_context():
+        with db.engine.connect() as conn:
+            conn.exec_driver_sql('SELECT 1')
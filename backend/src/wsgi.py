@@ -0,0 +1,4 @@
+from src.app import create_app
+
+# WSGI entry point for production servers: gunicorn -c gunicorn.conf.py src.wsgi:app
+app = create_app()
@@ -31,3 +31,30 @@ CREATE TABLE playlist_tracks (
     artist_name TEXT NOT NULL,
     PRIMARY KEY (playlist_id, spotify_track_id)
 );
+
+CREATE TABLE track_resolutions (
+    lookup_key TEXT PRIMARY KEY,
+    spotify_track_id TEXT,
+    spotify_uri TEXT,
+    resolved_at TIMESTAMP DEFAULT NOW(),
+    last_used_at TIMESTAMP DEFAULT NOW()
+);
+
+CREATE TABLE rec_jobs (
+    id UUID PRIMARY KEY DEFAULT gen_random_uuid(),
+    user_id UUID NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+    prompt TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'queued',
+    stage TEXT,
+    stages JSONB NOT NULL DEFAULT '[]',
+    result JSONB,
+    status_code INTEGER,
+    created_at TIMESTAMP DEFAULT NOW(),
+    updated_at TIMESTAMP DEFAULT NOW()
+);
+
+-- Keep in sync with backend/migrations (python -m src.migrate upgrade is a no-op on a fresh database)
+CREATE INDEX prompts_user_id_created_at_idx ON prompts (user_id, created_at, id);
+CREATE INDEX playlists_user_id_idx ON playlists (user_id);
+CREATE INDEX rec_jobs_user_id_idx ON rec_jobs (user_id);
+CREATE INDEX track_resolutions_last_used_at_idx ON track_resolutions (last_used_at);
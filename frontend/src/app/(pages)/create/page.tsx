@@ -55,7 +55,7 @@ const CreatePlaylist = () => {
   useEffect(() => {
     if (status === "authenticated" && session?.spotifyId) {
       const fetchPromptHistory = async () => {
-        const response = await fetch(`${BACKEND_API_URL}/get_prompts_by_spotify_id/${session.spotifyId}`);
+        const response = await fetch(`${BACKEND_API_URL}/get_prompts_by_spotify_id/${session.spotifyId}?limit=3`);
         if (response.ok) {
           const prompts = await response.json();
           // Get the mood from the most recent prompts (up to 3)